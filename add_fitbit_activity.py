@@ -1,56 +1,122 @@
 #!/usr/bin/env python3
 
+import argparse
+import asyncio
+import csv
+import functools
+import json
 import os
-import sys
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
+WALKING_ACTIVITY_ID = 90013  # Walking, from the Fitbit activity catalog
+_MS_PER_MIN = 60 * 1000
+
+BULK_CONCURRENCY = 5  # Keep well inside Fitbit's per-user rate limit
+
+MAX_RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BUFFER_SECONDS = 5  # Fitbit's reset clock can drift from ours
+
 class FitbitActivityLogger:
     def __init__(self):
         self.access_token = os.getenv('FITBIT_ACCESS_TOKEN')
         self.base_url = 'https://api.fitbit.com/1'
+        self.activities_url = f"{self.base_url}/user/-/activities.json"
 
         if not self.access_token:
             raise ValueError("Missing FITBIT_ACCESS_TOKEN in .env file")
 
-    def add_walking_activity(self, steps, start_time, duration_minutes, date=None):
-        """
-        Add a walking activity with steps to Fitbit.
-
-        Args:
-            steps: Number of steps taken
-            start_time: Start time in format "HH:MM" (e.g., "11:42")
-            duration_minutes: Duration in minutes
-            date: Date in YYYY-MM-DD format (defaults to today)
-        """
-        if date is None:
-            date = datetime.now().strftime('%Y-%m-%d')
-
-        # Walking activity ID from Fitbit catalog
-        activity_id = 90013  # Walking
-        duration_millis = duration_minutes * 60 * 1000  # Convert to milliseconds
-
-        url = f"{self.base_url}/user/-/activities.json"
-
-        headers = {
+        # Reuse one keep-alive connection for all calls instead of a fresh TLS handshake per POST
+        self.session = requests.Session()
+        self.session.headers.update({
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/x-www-form-urlencoded'
-        }
+        })
+        # Only retry what Fitbit can't have acted on: failed connects and 503. Read errors and
+        # other 5xx may already have created the activity. 429 is left to _post so Retry-After
+        # and the rate-limit headers are honoured precisely.
+        retry = Retry(total=3, connect=3, read=0, backoff_factor=0.5, status_forcelist=[503],
+                      allowed_methods=['POST'], respect_retry_after_header=False)
+        self.session.mount('https://', HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=10))
+
+        # Populated from the Fitbit-Rate-Limit-* headers of the last response
+        self.rate_limit_limit = None
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self.rate_limit_seen_at = None
+
+    def close(self):
+        """Close the underlying HTTP session."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _update_rate_limit(self, response):
+        """Record the rate-limit state Fitbit reports on every response."""
+        try:
+            limit = response.headers.get('Fitbit-Rate-Limit-Limit')
+            remaining = response.headers.get('Fitbit-Rate-Limit-Remaining')
+            reset = response.headers.get('Fitbit-Rate-Limit-Reset')
+            if limit is not None:
+                self.rate_limit_limit = int(limit)
+            if remaining is not None:
+                self.rate_limit_remaining = int(remaining)
+            if reset is not None:
+                self.rate_limit_reset = int(reset)
+            self.rate_limit_seen_at = time.time()
+        except ValueError:
+            pass
+
+    def _await_rate_limit(self):
+        """Sleep until the rate-limit window resets if we know the quota is exhausted."""
+        if self.rate_limit_remaining != 0 or self.rate_limit_reset is None:
+            return
 
-        data = {
-            'activityId': activity_id,
-            'startTime': start_time,
-            'durationMillis': duration_millis,
-            'date': date,
-            'distance': steps,  # Using steps as distance
-            'distanceUnit': 'steps'
-        }
+        elapsed = time.time() - self.rate_limit_seen_at
+        wait = self.rate_limit_reset + RATE_LIMIT_BUFFER_SECONDS - elapsed
+        if wait > 0:
+            print(f"⏳ Fitbit rate limit reached, waiting {wait:.0f}s for reset...")
+            time.sleep(wait)
+        self.rate_limit_remaining = None
+
+    def _post(self, url, data):
+        """POST to Fitbit, honouring rate-limit headers and backing off on HTTP 429."""
+        self._await_rate_limit()
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            response = self.session.post(url, data=data)
+            self._update_rate_limit(response)
+
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                return response
+
+            retry_after = response.headers.get('Retry-After')
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = float(self.rate_limit_reset or 1)
+            delay = max(delay, 2 ** attempt)
+            print(f"⏳ Fitbit returned 429, retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+    def _post_activity(self, data, description, show_steps=False):
+        """
+        Log one activity to Fitbit and print a summary of the created entry.
 
+        Returns the parsed JSON response, or None on failure.
+        """
         try:
-            response = requests.post(url, headers=headers, data=data)
+            response = self._post(self.activities_url, data)
 
             if response.status_code == 401:
                 print("❌ Token expired or invalid. Run setup_fitbit_oauth.py to get a new token.")
@@ -59,26 +125,52 @@ class FitbitActivityLogger:
             response.raise_for_status()
 
             result = response.json()
-            print("✅ Activity logged successfully!")
-
-            activity_log = result.get('activityLog', {})
-            print(f"📊 Activity Details:")
-            print(f"   Name: {activity_log.get('name', 'Unknown')}")
-            print(f"   Steps: {activity_log.get('steps', 0)}")
-            print(f"   Duration: {activity_log.get('duration', 0) // 60000} minutes")
-            print(f"   Start Time: {activity_log.get('startTime', 'Unknown')}")
-            print(f"   Date: {activity_log.get('startDate', 'Unknown')}")
-            print(f"   Calories: {activity_log.get('calories', 0)}")
-            print(f"   Log ID: {activity_log.get('logId', 'Unknown')}")
+            print(f"✅ {description.capitalize()} logged successfully!")
+            self._print_log(result.get('activityLog', {}), show_steps)
 
             return result
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ Error logging activity: {e}")
+            print(f"❌ Error logging {description}: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 print(f"Response: {e.response.text}")
             return None
 
+    @staticmethod
+    def _print_log(activity_log, show_steps):
+        print(f"📊 Activity Details:")
+        print(f"   Name: {activity_log.get('name', 'Unknown')}")
+        if show_steps:
+            print(f"   Steps: {activity_log.get('steps', 0)}")
+        print(f"   Duration: {activity_log.get('duration', 0) // _MS_PER_MIN} minutes")
+        print(f"   Start Time: {activity_log.get('startTime', 'Unknown')}")
+        print(f"   Date: {activity_log.get('startDate', 'Unknown')}")
+        print(f"   Calories: {activity_log.get('calories', 0)}")
+        print(f"   Log ID: {activity_log.get('logId', 'Unknown')}")
+
+    def add_walking_activity(self, steps, start_time, duration_minutes, date=None):
+        """
+        Add a walking activity with steps to Fitbit.
+
+        Args:
+            steps: Number of steps taken
+            start_time: Start time in format "HH:MM" (e.g., "11:42")
+            duration_minutes: Duration in minutes
+            date: Date in YYYY-MM-DD format (defaults to today)
+        """
+        if date is None:
+            date = datetime.now().strftime('%Y-%m-%d')
+
+        data = {
+            'activityId': WALKING_ACTIVITY_ID,
+            'startTime': start_time,
+            'durationMillis': duration_minutes * _MS_PER_MIN,
+            'date': date,
+            'distance': steps,  # Using steps as distance
+            'distanceUnit': 'steps'
+        }
+        return self._post_activity(data, 'activity', show_steps=True)
+
     def add_custom_activity(self, activity_name, calories, start_time, duration_minutes, date=None):
         """
         Add a custom activity to Fitbit.
@@ -93,108 +185,129 @@ class FitbitActivityLogger:
         if date is None:
             date = datetime.now().strftime('%Y-%m-%d')
 
-        duration_millis = duration_minutes * 60 * 1000
-
-        url = f"{self.base_url}/user/-/activities.json"
-
-        headers = {
-            'Authorization': f'Bearer {self.access_token}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-
         data = {
             'activityName': activity_name,
             'manualCalories': calories,
             'startTime': start_time,
-            'durationMillis': duration_millis,
+            'durationMillis': duration_minutes * _MS_PER_MIN,
             'date': date
         }
+        return self._post_activity(data, 'custom activity')
+
+    async def add_walking_activity_async(self, steps, start_time, duration_minutes, date=None):
+        """Non-blocking add_walking_activity for callers running an asyncio loop (e.g. BLE code)."""
+        return await self._run_in_executor(self.add_walking_activity, steps, start_time, duration_minutes, date)
+
+    async def add_custom_activity_async(self, activity_name, calories, start_time, duration_minutes, date=None):
+        """Non-blocking add_custom_activity for callers running an asyncio loop."""
+        return await self._run_in_executor(self.add_custom_activity, activity_name, calories, start_time, duration_minutes, date)
+
+    async def _run_in_executor(self, func, *args):
+        # The shared session keeps the pooled keep-alive connections, so concurrent
+        # calls from the default executor reuse them instead of re-handshaking.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+def load_bulk_rows(path):
+    """
+    Read walking activities from a CSV (with header) or JSONL file.
+
+    Each row needs steps, start_time and duration_minutes; date is optional.
+    """
+    with open(path, 'r') as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    return [
+        {
+            'steps': int(row['steps']),
+            'start_time': row['start_time'],
+            'duration_minutes': int(row['duration_minutes']),
+            'date': row.get('date') or None
+        }
+        for row in rows
+    ]
+
+async def add_bulk_activities(logger, rows):
+    """Log many walking activities concurrently over the logger's pooled session."""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def add_one(row):
+        async with semaphore:
+            return await logger.add_walking_activity_async(**row)
+
+    return await asyncio.gather(*(add_one(row) for row in rows), return_exceptions=True)
+
+def build_parser():
+    """Build the command-line parser with one subcommand per activity type."""
+    parser = argparse.ArgumentParser(
+        description="🚶 Fitbit Activity Logger",
+        epilog="Times should be in HH:MM format (24-hour). Dates should be in YYYY-MM-DD format."
+    )
+    sub = parser.add_subparsers(dest='cmd')
+
+    walking = sub.add_parser('walking', help='Add walking activity (e.g. walking 169 11:42 3 2023-12-07)')
+    walking.add_argument('steps', type=int)
+    walking.add_argument('start_time')
+    walking.add_argument('duration_minutes', type=int)
+    walking.add_argument('date', nargs='?')
+
+    custom = sub.add_parser('custom', help='Add custom activity (e.g. custom "Treadmill Walking" 50 11:42 3)')
+    custom.add_argument('activity_name')
+    custom.add_argument('calories', type=int)
+    custom.add_argument('start_time')
+    custom.add_argument('duration_minutes', type=int)
+    custom.add_argument('date', nargs='?')
+
+    bulk = sub.add_parser('bulk', help='Add many walking activities from a CSV/JSONL file '
+                                       '(columns: steps, start_time, duration_minutes, [date])')
+    bulk.add_argument('path')
+
+    return parser
+
+def run_walking(logger, args):
+    print(f"📝 Logging {args.steps} steps from {args.start_time} for {args.duration_minutes} minutes...")
+    logger.add_walking_activity(args.steps, args.start_time, args.duration_minutes, args.date)
+
+def run_custom(logger, args):
+    print(f"📝 Logging custom activity '{args.activity_name}' ({args.calories} calories) from {args.start_time} for {args.duration_minutes} minutes...")
+    logger.add_custom_activity(args.activity_name, args.calories, args.start_time, args.duration_minutes, args.date)
+
+def run_bulk(logger, args):
+    rows = load_bulk_rows(args.path)
+    print(f"📝 Logging {len(rows)} walking activities from {args.path}...")
+    results = asyncio.run(add_bulk_activities(logger, rows))
+    logged = sum(1 for r in results if r is not None and not isinstance(r, BaseException))
+    print(f"📦 Logged {logged}/{len(rows)} activities")
+
+COMMANDS = {
+    'walking': run_walking,
+    'custom': run_custom,
+    'bulk': run_bulk,
+}
 
-        try:
-            response = requests.post(url, headers=headers, data=data)
-
-            if response.status_code == 401:
-                print("❌ Token expired or invalid. Run setup_fitbit_oauth.py to get a new token.")
-                return None
-
-            response.raise_for_status()
-
-            result = response.json()
-            print("✅ Custom activity logged successfully!")
-
-            activity_log = result.get('activityLog', {})
-            print(f"📊 Activity Details:")
-            print(f"   Name: {activity_log.get('name', 'Unknown')}")
-            print(f"   Duration: {activity_log.get('duration', 0) // 60000} minutes")
-            print(f"   Start Time: {activity_log.get('startTime', 'Unknown')}")
-            print(f"   Date: {activity_log.get('startDate', 'Unknown')}")
-            print(f"   Calories: {activity_log.get('calories', 0)}")
-            print(f"   Log ID: {activity_log.get('logId', 'Unknown')}")
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
 
-            return result
+    if args.cmd is None:
+        parser.print_help()
+        return
 
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error logging custom activity: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response: {e.response.text}")
-            return None
-
-def main():
+    logger = None
     try:
         logger = FitbitActivityLogger()
-
-        if len(sys.argv) < 2:
-            print("🚶 Fitbit Activity Logger\n")
-            print("Usage:")
-            print("  Add walking activity:")
-            print("    python add_fitbit_activity.py walking <steps> <start_time> <duration_minutes> [date]")
-            print("    Example: python add_fitbit_activity.py walking 169 11:42 3")
-            print("    Example: python add_fitbit_activity.py walking 169 11:42 3 2023-12-07")
-            print()
-            print("  Add custom activity:")
-            print("    python add_fitbit_activity.py custom <name> <calories> <start_time> <duration_minutes> [date]")
-            print("    Example: python add_fitbit_activity.py custom \"Treadmill Walking\" 50 11:42 3")
-            print()
-            print("Times should be in HH:MM format (24-hour)")
-            print("Dates should be in YYYY-MM-DD format")
-            return
-
-        activity_type = sys.argv[1].lower()
-
-        if activity_type == 'walking':
-            if len(sys.argv) < 5:
-                print("❌ Usage: python add_fitbit_activity.py walking <steps> <start_time> <duration_minutes> [date]")
-                return
-
-            steps = int(sys.argv[2])
-            start_time = sys.argv[3]
-            duration_minutes = int(sys.argv[4])
-            date = sys.argv[5] if len(sys.argv) > 5 else None
-
-            print(f"📝 Logging {steps} steps from {start_time} for {duration_minutes} minutes...")
-            logger.add_walking_activity(steps, start_time, duration_minutes, date)
-
-        elif activity_type == 'custom':
-            if len(sys.argv) < 6:
-                print("❌ Usage: python add_fitbit_activity.py custom <name> <calories> <start_time> <duration_minutes> [date]")
-                return
-
-            activity_name = sys.argv[2]
-            calories = int(sys.argv[3])
-            start_time = sys.argv[4]
-            duration_minutes = int(sys.argv[5])
-            date = sys.argv[6] if len(sys.argv) > 6 else None
-
-            print(f"📝 Logging custom activity '{activity_name}' ({calories} calories) from {start_time} for {duration_minutes} minutes...")
-            logger.add_custom_activity(activity_name, calories, start_time, duration_minutes, date)
-
-        else:
-            print("❌ Invalid activity type. Use 'walking' or 'custom'")
+        COMMANDS[args.cmd](logger, args)
 
     except ValueError as e:
         print(f"❌ Error: {e}")
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
+    finally:
+        if logger:
+            logger.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -5,10 +5,12 @@ Monitors power/display events and maintains persistent BLE connection
 """
 
 import asyncio
+import json
+import logging
+import sys
 import time
 import subprocess
 import warnings
-from datetime import datetime
 from ph4_walkingpad.pad import WalkingPad, Controller
 from ph4_walkingpad.utils import setup_logging
 from bleak import BleakScanner
@@ -16,10 +18,59 @@ import threading
 import os
 import signal
 
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]  # milliseconds
-    print(f"[{timestamp}] {message}")
+try:
+    # Python 3.11+: cancels the current task on expiry instead of wrapping it in a new one
+    from asyncio import timeout as ble_timeout
+except ImportError:
+    from async_timeout import timeout as ble_timeout
+
+# PyObjC probe functions (macOS only), loaded on first use by the probes that need them so
+# importing this module doesn't pay for Quartz/IOKit. None = not tried yet, False = unavailable.
+_display_api = None
+_power_api = None
+
+def _load_display_api():
+    """CGGetOnlineDisplayList - lets us count displays without spawning a subprocess"""
+    global _display_api
+    if _display_api is None:
+        try:
+            from Quartz import CGGetOnlineDisplayList
+            _display_api = CGGetOnlineDisplayList
+        except ImportError:
+            _display_api = False
+    return _display_api
+
+def _load_power_api():
+    """(IOPSCopyPowerSourcesInfo, IOPSGetProvidingPowerSourceType) - avoids forking pmset"""
+    global _power_api
+    if _power_api is None:
+        try:
+            import objc
+            from Foundation import NSBundle
+            iokit = {}
+            objc.loadBundleFunctions(
+                NSBundle.bundleWithIdentifier_('com.apple.framework.IOKit'),
+                iokit,
+                [
+                    # Copy-rule function: the caller owns the result, so PyObjC must not retain it again
+                    ('IOPSCopyPowerSourcesInfo', b'@', '', {'retval': {'already_cfretained': True}}),
+                    ('IOPSGetProvidingPowerSourceType', b'@@'),
+                ]
+            )
+            _power_api = (iokit['IOPSCopyPowerSourcesInfo'], iokit['IOPSGetProvidingPowerSourceType'])
+        except Exception:
+            _power_api = False
+    return _power_api
+
+# Same "[YYYY-mm-dd HH:MM:SS.mmm] message" lines as before, but through logging so
+# messages below the configured level are never formatted
+logger = logging.getLogger("walkingpad.connection")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("[%(asctime)s.%(msecs)03d] %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
 
 def handle_unhandled_exception(loop, context):
     """Handle unhandled exceptions in async loop to prevent BleakError pileup"""
@@ -30,59 +81,179 @@ def handle_unhandled_exception(loop, context):
             # Suppress BleakError disconnected messages that are expected during sleep/wake
             pass
         else:
-            log_with_timestamp(f"Unhandled async exception: {exception}")
+            logger.info("Unhandled async exception: %s", exception)
     else:
-        log_with_timestamp(f"Unhandled async context: {context}")
+        logger.info("Unhandled async context: %s", context)
+
+def _reset_controller_state(ctrl):
+    """Drop a Controller's BleakClient and characteristics so no stale futures linger on them.
+
+    ph4_walkingpad has no reset; run() sets these attributes and reconnects from scratch.
+    """
+    ctrl.client = None
+    ctrl.char_fe01 = None
+    ctrl.char_fe02 = None
 
 class WalkingPadConnectionManager:
     def __init__(self, address):
         self.address = address
-        self.controller = Controller()
-        # Reduce very chatty INFO logs from ph4_walkingpad on every BLE notification
-        # to avoid filling launchd-managed stdout/stderr logs.
-        self.controller.log_messages_info = False
+        self._address_upper = address.upper()  # normalised once for address comparisons
+        self.last_status_ts = 0.0  # time.monotonic() of the last current-status notification
+        self.controller = self._new_controller()
         self.log = setup_logging()
         self.connected = False
         self.last_connection_attempt = 0
+        self.consecutive_failures = 0
         self.last_health_check = 0
+        self._last_successful_ask_stats_ts = 0.0  # time.monotonic() of the last ask_stats that succeeded
         self.connection_start_time = 0
-        # Avoid simultaneous connect attempts; use threading lock since we have multiple loops
-        # across threads (monitor thread + request loop)
-        import threading as _threading
-        self._connect_lock = _threading.Lock()
+        # Serialises connect attempts. All BLE work runs on the monitor loop, so an asyncio.Lock
+        # suffices; it is created on first use so it binds to the loop that actually uses it.
+        self._connect_lock = None
+        # Set (and replaced) on every successful connect so waiting callers wake up at once
+        self._connected_event = None
         self.monitoring_active = False
         self.monitor_thread = None
-        self.scan_cache = {}
+        self._monitor_loop = None
+        self._wake_event = None
+        self._monitor_ready = threading.Event()
+        # Long-lived scanner reporting every advertisement of the pad, see _on_advertisement
+        self._scanner = None
+        self._scan_waiter = None  # asyncio.Event of a scan_for_device call waiting for the pad
         self.scan_cache_timeout = 30  # seconds
+        # Persisted so a restarted monitor can skip the initial scan if the pad was seen recently
+        self.scan_cache_path = os.path.expanduser("~/.cache/walkingpad/scan_cache.json")
+        self.scan_cache = self._load_scan_cache()
         self.health_check_interval = 5  # seconds - more frequent for better sleep/wake detection
         self.max_connection_age = 180  # 3 minutes max before reconnect (reduced for stability)
         # Timeouts (seconds)
         self.ble_connect_timeout = 10.0
         self.ble_cmd_timeout = 5.0
+        self.scan_timeout = 2.0  # the scan ends on the first advertisement, this only bounds a miss
+        # Cached (timestamp, value) results of the system state probes
+        self._power_cache = (0.0, False)
+        self._display_cache = (0.0, False)
+        self.power_cache_ttl = 30  # seconds - power source changes often
+        self.display_cache_ttl = 120  # seconds - displays are rarely hotplugged
+        self.away_retry_interval = 60  # seconds between attempts while away from the desk
+        self.probe_timeout = 2  # seconds - a hung probe must not freeze the monitor
         
-    async def scan_for_device(self):
-        """Scan for WalkingPad device before attempting connection"""
+    def _new_controller(self, previous=None):
+        """Create a Controller wired to our status tracking, keeping the previous one's record handler"""
+        controller = Controller()
+        # Reduce very chatty INFO logs from ph4_walkingpad on every BLE notification
+        # to avoid filling launchd-managed stdout/stderr logs.
+        controller.log_messages_info = False
+        controller.handler_cur_status = self._on_cur_status
+        # The new controller has no status yet, so whatever age we tracked no longer applies
+        self.last_status_ts = 0.0
+        if previous is not None:
+            controller.handler_last_status = previous.handler_last_status
+        return controller
+
+    def _on_cur_status(self, sender, status):
+        """Record when the pad last reported its current status"""
+        self.last_status_ts = time.monotonic()
+
+    def status_age(self):
+        """Seconds since controller.last_status was refreshed by the pad"""
+        return time.monotonic() - self.last_status_ts
+
+    def _on_advertisement(self, device, adv):
+        """Detection callback of the persistent scanner; records the pad each time it advertises"""
+        if device.address.upper() != self._address_upper:
+            return
+
+        # The pad advertises several times a second - only log, persist and wake on a reappearance
+        reappeared = not self.is_scan_cache_valid()
+        name = adv.local_name or device.name
+        self.scan_cache[self.address] = {
+            'device': device,
+            'address': device.address,
+            'name': name,
+            'timestamp': time.time(),
+            'rssi': adv.rssi
+        }
+        if reappeared:
+            self._save_scan_cache()
+            logger.info("Found WalkingPad: %s (%s) RSSI: %s", name, device.address, adv.rssi)
+            if not self.connected and self._wake_event is not None:
+                self._wake_event.set()
+        if self._scan_waiter is not None:
+            self._scan_waiter.set()
+
+    async def _ensure_scanner(self):
+        """Start the persistent scanner on the running loop unless it is already up"""
+        if self._scanner is not None:
+            return True
+        scanner = BleakScanner(detection_callback=self._on_advertisement)
         try:
-            log_with_timestamp(f"Scanning for WalkingPad device {self.address}...")
-            devices = await BleakScanner.discover(timeout=5.0)
-            
-            for device in devices:
-                if device.address.upper() == self.address.upper():
-                    self.scan_cache[self.address] = {
-                        'device': device,
-                        'timestamp': time.time(),
-                        'rssi': device.rssi if hasattr(device, 'rssi') else None
-                    }
-                    log_with_timestamp(f"Found WalkingPad: {device.name} ({device.address}) RSSI: {getattr(device, 'rssi', 'N/A')}")
-                    return True
-            
-            log_with_timestamp(f"WalkingPad {self.address} not found in scan")
-            return False
-            
+            await scanner.start()
         except Exception as e:
-            log_with_timestamp(f"Scan failed: {e}")
+            logger.info("Could not start BLE scanner: %s", e)
             return False
-    
+        self._scanner = scanner
+        logger.debug("Persistent BLE scanner started")
+        return True
+
+    async def stop_scanner(self):
+        """Stop the persistent scanner if it is running"""
+        scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            try:
+                await scanner.stop()
+            except Exception as e:
+                logger.debug("Stopping BLE scanner failed: %s", e)
+
+    async def scan_for_device(self):
+        """Wait for the persistent scanner to see the next advertisement of the WalkingPad"""
+        if not await self._ensure_scanner():
+            return False
+
+        logger.debug("Scanning for WalkingPad device %s...", self.address)
+        self._scan_waiter = asyncio.Event()
+        try:
+            async with ble_timeout(self.scan_timeout):
+                await self._scan_waiter.wait()
+            return True
+        except asyncio.TimeoutError:
+            logger.info("WalkingPad %s not found in scan", self.address)
+            return False
+        finally:
+            self._scan_waiter = None
+
+    def _load_scan_cache(self):
+        """Load persisted scan results, ignoring a missing or corrupt cache file"""
+        try:
+            with open(self.scan_cache_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_scan_cache(self):
+        """Persist scan results; BLEDevice objects are not serialisable so only metadata is kept"""
+        try:
+            os.makedirs(os.path.dirname(self.scan_cache_path), exist_ok=True)
+            persisted = {
+                address: {key: value for key, value in entry.items() if key != 'device'}
+                for address, entry in self.scan_cache.items()
+            }
+            with open(self.scan_cache_path, 'w') as f:
+                json.dump(persisted, f)
+        except OSError as e:
+            logger.info("Could not persist scan cache: %s", e)
+
+    def connect_target(self):
+        """Return the cached BLEDevice if we have one, else the raw address.
+
+        Handing bleak a BLEDevice lets it connect straight away; with a bare
+        address string it runs its own discovery scan before connecting.
+        """
+        entry = self.scan_cache.get(self.address)
+        if entry and entry.get('device') is not None and self.is_scan_cache_valid():
+            return entry['device']
+        return self.address
+
     def is_scan_cache_valid(self):
         """Check if we have a recent scan result"""
         if self.address not in self.scan_cache:
@@ -93,20 +264,19 @@ class WalkingPadConnectionManager:
     
     async def connect_with_exponential_backoff(self, max_attempts=5):
         """Connect with exponential backoff strategy"""
-        # Guard against concurrent connection attempts across threads/loops
-        if not self._connect_lock.acquire(blocking=False):
-            # Another attempt in progress; wait briefly and report current state
-            await asyncio.sleep(0.1)
-            return self.connected
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
 
-        try:
+        # Concurrent callers wait for the attempt in progress and then share its outcome
+        async with self._connect_lock:
             if self.connected:
                 return True
 
             # Use cached scan result if available, otherwise scan first
             if not self.is_scan_cache_valid():
                 if not await self.scan_for_device():
-                    log_with_timestamp("Device not found in scan, skipping connection attempt")
+                    logger.info("Device not found in scan, skipping connection attempt")
+                    self.consecutive_failures += 1
                     return False
 
             base_delay = 0.5  # Start with 500ms
@@ -117,117 +287,155 @@ class WalkingPadConnectionManager:
                     delay = min(base_delay * (2 ** attempt), max_delay)
 
                     if attempt > 0:
-                        log_with_timestamp(f"Waiting {delay:.1f}s before attempt {attempt + 1}")
+                        logger.debug("Waiting %.1fs before attempt %s", delay, attempt + 1)
                         await asyncio.sleep(delay)
 
-                    log_with_timestamp(f"Connection attempt {attempt + 1}/{max_attempts}")
+                    logger.debug("Connection attempt %s/%s", attempt + 1, max_attempts)
                     # Bound BLE connect and probe with timeouts to avoid hanging
-                    await asyncio.wait_for(self.controller.run(self.address), timeout=self.ble_connect_timeout)
+                    async with ble_timeout(self.ble_connect_timeout):
+                        await self.controller.run(self.connect_target())
 
                     # Test connection with a quick status request
                     await asyncio.sleep(0.1)
-                    await asyncio.wait_for(self.controller.ask_stats(), timeout=self.ble_cmd_timeout)
+                    async with ble_timeout(self.ble_cmd_timeout):
+                        await self.controller.ask_stats()
 
                     self.connected = True
                     self.last_connection_attempt = time.time()
                     self.connection_start_time = time.time()
-                    log_with_timestamp("✅ Connected successfully with exponential backoff!")
+                    # The probe above doubles as a health check - lets the monitor skip its next one
+                    self.last_health_check = time.time()
+                    self._last_successful_ask_stats_ts = time.monotonic()
+                    self.consecutive_failures = 0
+                    self._notify_connected()
+                    logger.info("✅ Connected successfully with exponential backoff!")
                     return True
 
                 except asyncio.TimeoutError:
-                    log_with_timestamp(f"Attempt {attempt + 1} timed out during BLE operation")
+                    logger.info("Attempt %s timed out during BLE operation", attempt + 1)
                     self.connected = False
                     # Best-effort disconnect to reset state
                     try:
-                        await asyncio.wait_for(self.controller.disconnect(), timeout=2.0)
+                        async with ble_timeout(2.0):
+                            await self.controller.disconnect()
                     except Exception:
                         pass
                     if attempt == max_attempts - 1:
-                        log_with_timestamp(f"❌ All {max_attempts} connection attempts timed out")
+                        logger.info("❌ All %s connection attempts timed out", max_attempts)
                 except Exception as e:
                     # Handle BleakError and other BLE exceptions gracefully
                     error_msg = str(e)
                     if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                        log_with_timestamp(f"Attempt {attempt + 1} BLE disconnection: {error_msg}")
+                        logger.info("Attempt %s BLE disconnection: %s", attempt + 1, error_msg)
                     else:
-                        log_with_timestamp(f"Attempt {attempt + 1} failed: {e}")
+                        logger.info("Attempt %s failed: %s", attempt + 1, e)
 
                     self.connected = False
                     # Clean disconnect on any error with proper async cleanup
                     try:
-                        await asyncio.wait_for(self.controller.disconnect(), timeout=1.0)
+                        async with ble_timeout(1.0):
+                            await self.controller.disconnect()
                     except Exception:
                         # Force reset controller state to prevent lingering futures
-                        if hasattr(self.controller, '_client'):
-                            self.controller._client = None
-                        if hasattr(self.controller, '_device'):
-                            self.controller._device = None
+                        _reset_controller_state(self.controller)
 
                     if attempt == max_attempts - 1:
-                        log_with_timestamp(f"❌ All {max_attempts} connection attempts failed")
+                        logger.info("❌ All %s connection attempts failed", max_attempts)
 
+            self.consecutive_failures += 1
             return False
-        finally:
-            try:
-                self._connect_lock.release()
-            except Exception:
-                pass
     
+    def _notify_connected(self):
+        """Wake everyone waiting in _wait_for_connect and arm a fresh event for the next connect"""
+        if self._connected_event is not None:
+            self._connected_event.set()
+        self._connected_event = asyncio.Event()
+
+    async def _wait_for_connect(self, timeout):
+        """Wait up to timeout for any connect attempt - ours or the monitor's - to succeed"""
+        if self.connected:
+            return
+        if self._connected_event is None:
+            self._connected_event = asyncio.Event()
+        try:
+            async with ble_timeout(timeout):
+                await self._connected_event.wait()
+        except asyncio.TimeoutError:
+            pass
+
     async def disconnect_safe(self):
         """Safely disconnect and COMPLETELY reset controller"""
-        if self.connected:
+        # Callers often clear self.connected first, so go by the client: any link the old
+        # controller still holds has to be closed before the controller is replaced
+        if self.controller.client is not None:
             try:
-                # Force cleanup of controller internal state first
-                if hasattr(self.controller, '_client') and self.controller._client:
-                    try:
-                        # Clean disconnect
-                        await asyncio.wait_for(self.controller.disconnect(), timeout=2.0)
-                    except Exception:
-                        pass  # Ignore disconnect errors
-
-                self.connected = False
-                log_with_timestamp("Disconnected safely - recreating controller")
+                async with ble_timeout(2.0):
+                    await self.controller.disconnect()
+                logger.info("Disconnected safely - recreating controller")
             except Exception as e:
                 error_msg = str(e)
                 if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                    log_with_timestamp(f"Disconnect BLE error (expected): {error_msg}")
+                    logger.info("Disconnect BLE error (expected): %s", error_msg)
                 else:
-                    log_with_timestamp(f"Disconnect error: {e}")
-                self.connected = False
+                    logger.info("Disconnect error: %s", e)
+        self.connected = False
 
         # NUCLEAR RESET: Create completely fresh controller
-        log_with_timestamp("Creating fresh controller instance")
+        logger.info("Creating fresh controller instance")
         old_controller = self.controller
-        self.controller = Controller()
-        self.controller.log_messages_info = False
+        self.controller = self._new_controller(old_controller)
 
         # Clean up old controller
-        try:
-            if hasattr(old_controller, '_client'):
-                old_controller._client = None
-            if hasattr(old_controller, '_device'):
-                old_controller._device = None
-            del old_controller
-        except Exception:
-            pass
+        _reset_controller_state(old_controller)
     
     def check_power_connected(self):
-        """Check if laptop is connected to power (macOS)"""
+        """Check if laptop is connected to power (macOS), cached for power_cache_ttl"""
+        timestamp, value = self._power_cache
+        if time.time() - timestamp < self.power_cache_ttl:
+            return value
+
         try:
-            result = subprocess.run(['pmset', '-g', 'ps'], capture_output=True, text=True)
-            return 'AC Power' in result.stdout
+            power_api = _load_power_api()
+            if power_api:
+                copy_info, get_providing_type = power_api
+                value = get_providing_type(copy_info()) == 'AC Power'
+            else:
+                result = subprocess.run(['pmset', '-g', 'ps'], capture_output=True, timeout=self.probe_timeout)
+                value = b'AC Power' in result.stdout
+        except subprocess.TimeoutExpired:
+            logger.info("pmset timed out after %ss", self.probe_timeout)
+            value = False
         except:
-            return False
+            value = False
+
+        self._power_cache = (time.time(), value)
+        return value
     
     def check_external_display(self):
-        """Check if external display is connected (macOS)"""
+        """Check if external display is connected (macOS), cached for display_cache_ttl"""
+        timestamp, value = self._display_cache
+        if time.time() - timestamp < self.display_cache_ttl:
+            return value
+
         try:
-            result = subprocess.run(['system_profiler', 'SPDisplaysDataType'], capture_output=True, text=True)
-            # Count displays - if more than 1, external display likely connected
-            display_count = result.stdout.count('Resolution:')
-            return display_count > 1
+            get_display_list = _load_display_api()
+            if get_display_list:
+                err, _, display_count = get_display_list(8, None, None)
+                value = err == 0 and display_count > 1
+            else:
+                # ioreg is much cheaper than system_profiler; we only need to know
+                # whether a second display entry exists, so stop at the second match
+                result = subprocess.run(['ioreg', '-rc', 'AppleDisplay'], capture_output=True, timeout=self.probe_timeout)
+                first = result.stdout.find(b'IODisplayConnectFlags')
+                value = first != -1 and result.stdout.find(b'IODisplayConnectFlags', first + 1) != -1
+        except subprocess.TimeoutExpired:
+            logger.info("ioreg timed out after %ss", self.probe_timeout)
+            value = False
         except:
-            return False
+            value = False
+
+        self._display_cache = (time.time(), value)
+        return value
     
     def should_attempt_connection(self):
         """Always attempt connection - we want to maintain it whenever possible"""
@@ -236,8 +444,19 @@ class WalkingPadConnectionManager:
         if time_since_last < 5:  # Reduced to 5 seconds for more responsive connection
             return False
 
+        # On battery with no external display we're likely away from the desk (and the pad),
+        # so retry less often - unless the pad was just seen advertising
+        if time_since_last < self.away_retry_interval and not self.is_scan_cache_valid():
+            if not self.check_power_connected() and not self.check_external_display():
+                return False
+
         return True  # Always try to connect when not connected
     
+    def monitor_sleep_interval(self):
+        """Seconds until the next monitor pass - backs off while the pad keeps failing to connect"""
+        # 10s normally, doubling per consecutive failure up to 10 minutes (e.g. pad unplugged overnight)
+        return min(10 * (2 ** min(self.consecutive_failures, 6)), 600)
+
     def is_connection_stale(self):
         """Check if connection is too old and should be refreshed"""
         if not self.connected:
@@ -264,32 +483,34 @@ class WalkingPadConnectionManager:
             if self.connected:
                 # Test if connection is responsive with shorter timeout for sleep detection
                 try:
-                    await asyncio.wait_for(self.controller.ask_stats(), timeout=2.0)
+                    async with ble_timeout(2.0):
+                        await self.controller.ask_stats()
+                    self._last_successful_ask_stats_ts = time.monotonic()
                 except asyncio.TimeoutError:
-                    log_with_timestamp("Health check timeout - validating if device is still discoverable")
+                    logger.info("Health check timeout - validating if device is still discoverable")
                     # Double-check by scanning - if device is discoverable but connection fails, force reset
                     if await self.scan_for_device():
-                        log_with_timestamp("Device found in scan but connection unresponsive - forcing reset")
+                        logger.info("Device found in scan but connection unresponsive - forcing reset")
                         await self.disconnect_safe()
                         self.connected = False
                         return False
                     else:
-                        log_with_timestamp("Device not discoverable - will keep trying to reconnect")
+                        logger.info("Device not discoverable - will keep trying to reconnect")
                         self.connected = False
                         return False
                 except Exception as e:
                     error_msg = str(e)
                     if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                        log_with_timestamp("Health check detected BLE disconnection - forcing clean reset")
+                        logger.info("Health check detected BLE disconnection - forcing clean reset")
                         await self.disconnect_safe()
                     else:
-                        log_with_timestamp(f"Health check connection error: {e}")
+                        logger.info("Health check connection error: %s", e)
                     self.connected = False
                     return False
 
                 # Check if connection is stale
                 if self.is_connection_stale():
-                    log_with_timestamp("Connection is stale, forcing reconnect")
+                    logger.info("Connection is stale, forcing reconnect")
                     await self.disconnect_safe()
                     self.connected = False
                     return False
@@ -301,49 +522,103 @@ class WalkingPadConnectionManager:
         except Exception as e:
             error_msg = str(e)
             if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                log_with_timestamp(f"Health check BLE disconnection (sleep/wake): {error_msg}")
+                logger.info("Health check BLE disconnection (sleep/wake): %s", error_msg)
             else:
-                log_with_timestamp(f"Health check failed: {e}")
+                logger.info("Health check failed: %s", e)
             self.connected = False
             return False
     
     async def monitor_and_connect(self):
         """Background task to continuously scan for and maintain WalkingPad connection"""
-        log_with_timestamp("🔍 Starting always-on WalkingPad monitoring...")
+        logger.info("🔍 Starting always-on WalkingPad monitoring...")
+        # Created here so they belong to the monitor thread's loop
+        self._monitor_loop = asyncio.get_running_loop()
+        self._wake_event = asyncio.Event()
+        self._connect_lock = asyncio.Lock()
+        self._connected_event = asyncio.Event()
+        # A scanner left over from a crashed monitor belonged to a loop that is gone
+        self._scanner = None
+        await self._ensure_scanner()
+        self._monitor_ready.set()
 
+        try:
+            await self._monitor()
+        finally:
+            await self.stop_scanner()
+
+    async def _monitor(self):
+        """Health-check the link and reconnect when it drops, until monitoring is stopped"""
         while self.monitoring_active:
             try:
                 # Health check for existing connections
                 if self.connected:
                     health_ok = await self.health_check()
                     if not health_ok:
-                        log_with_timestamp("Health check failed, performing cleanup and reconnection")
+                        logger.info("Health check failed, performing cleanup and reconnection")
                         self.connected = False
                         # Force disconnect with proper state cleanup
                         await self.disconnect_safe()
 
                 # Always attempt connection if not connected (continuous scanning strategy)
                 if not self.connected and self.should_attempt_connection():
-                    log_with_timestamp("🔄 Continuously scanning for WalkingPad...")
+                    logger.info("🔄 Continuously scanning for WalkingPad...")
                     success = await self.connect_with_exponential_backoff()
                     if success:
-                        log_with_timestamp("✅ WalkingPad connection established!")
+                        logger.info("✅ WalkingPad connection established!")
                     else:
-                        log_with_timestamp("❌ Connection failed, will retry soon")
+                        logger.info("❌ Connection failed, will retry soon")
 
-                await asyncio.sleep(10)  # Check every 10 seconds
+                await self._wait_for_wake(self.monitor_sleep_interval())
 
             except Exception as e:
-                log_with_timestamp(f"Monitor error: {e}")
+                logger.info("Monitor error: %s", e)
                 # Mark as disconnected on critical errors
                 self.connected = False
                 await asyncio.sleep(15)  # Shorter wait on errors for faster recovery
     
+    async def _wait_for_wake(self, timeout):
+        """Sleep until the next periodic pass, or until a disconnect is reported or the pad reappears"""
+        try:
+            async with ble_timeout(timeout):
+                await self._wake_event.wait()
+        except asyncio.TimeoutError:
+            pass
+        self._wake_event.clear()
+
+    def request_reconnect(self):
+        """Mark the link as lost and wake the monitor so it reconnects immediately.
+
+        Safe to call from any thread or event loop.
+        """
+        self.connected = False
+        loop, event = self._monitor_loop, self._wake_event
+        if loop is not None and event is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
+
+    async def run_on_monitor_loop(self, coro):
+        """Run a coroutine on the monitor's event loop and await its result from any loop.
+
+        The controller and its BLE connection belong to the monitor loop, so request
+        handlers running on their own loops must hand their BLE work over to it.
+        """
+        if not self._monitor_ready.is_set():
+            # Monitor thread may still be starting up
+            await asyncio.get_running_loop().run_in_executor(None, self._monitor_ready.wait, 5)
+
+        loop = self._monitor_loop
+        if loop is None or not loop.is_running():
+            coro.close()
+            raise Exception("WalkingPad monitor loop is not running")
+
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
     def start_monitoring(self):
         """Start the background monitoring with auto-recovery"""
         self.monitoring_active = True
         self._start_monitor_thread()
-        log_with_timestamp("✅ Connection monitoring started")
+        logger.info("✅ Connection monitoring started")
     
     def _start_monitor_thread(self):
         """Start the actual monitoring thread with unhandled exception handler"""
@@ -354,11 +629,13 @@ class WalkingPadConnectionManager:
                 # Set exception handler to suppress BleakError disconnected spam
                 loop.set_exception_handler(handle_unhandled_exception)
                 loop.run_until_complete(self.monitor_and_connect())
+                self._monitor_ready.clear()
             except Exception as e:
-                log_with_timestamp(f"Monitor thread crashed: {e}")
+                self._monitor_ready.clear()
+                logger.info("Monitor thread crashed: %s", e)
                 # Auto-recovery: restart the thread after delay
                 if self.monitoring_active:
-                    log_with_timestamp("Attempting monitor thread auto-recovery...")
+                    logger.info("Attempting monitor thread auto-recovery...")
                     time.sleep(5)
                     self._start_monitor_thread()
 
@@ -368,7 +645,7 @@ class WalkingPadConnectionManager:
     def stop_monitoring(self):
         """Stop the background monitoring"""
         self.monitoring_active = False
-        log_with_timestamp("⏹️  Connection monitoring stopped")
+        logger.info("⏹️  Connection monitoring stopped")
     
     async def get_connection(self, timeout=30):
         """Get a connection, attempting to connect if necessary with timeout"""
@@ -376,19 +653,25 @@ class WalkingPadConnectionManager:
         
         # Check if we have a healthy connection
         if self.connected:
+            # The monitor probes the link every health_check_interval; trust a recent success
+            if time.monotonic() - self._last_successful_ask_stats_ts < self.health_check_interval:
+                return self.controller
             try:
                 # Quick health check to ensure connection is responsive
-                await asyncio.wait_for(self.controller.ask_stats(), timeout=self.ble_cmd_timeout)
+                async with ble_timeout(self.ble_cmd_timeout):
+                    await self.controller.ask_stats()
+                self.last_health_check = time.time()
+                self._last_successful_ask_stats_ts = time.monotonic()
                 return self.controller
             except asyncio.TimeoutError:
-                log_with_timestamp("Connection timeout during health check, marking as disconnected")
+                logger.info("Connection timeout during health check, marking as disconnected")
                 self.connected = False
             except Exception as e:
                 error_msg = str(e)
                 if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                    log_with_timestamp(f"Connection health check BLE disconnection: {error_msg}")
+                    logger.info("Connection health check BLE disconnection: %s", error_msg)
                 else:
-                    log_with_timestamp(f"Connection health check failed: {e}")
+                    logger.info("Connection health check failed: %s", e)
                 self.connected = False
         
         # Attempt connection within timeout
@@ -398,29 +681,35 @@ class WalkingPadConnectionManager:
                 if self.is_scan_cache_valid():
                     try:
                         remaining = max(1.0, timeout - (time.time() - start_time))
-                        if await asyncio.wait_for(self.connect_with_exponential_backoff(max_attempts=2), timeout=remaining):
+                        async with ble_timeout(remaining):
+                            connected = await self.connect_with_exponential_backoff(max_attempts=2)
+                        if connected:
                             return self.controller
                     except asyncio.TimeoutError:
-                        log_with_timestamp("Timed out during fast connect attempts")
+                        logger.info("Timed out during fast connect attempts")
                         pass
                 
                 # Fallback to scanning + connecting
                 try:
                     remaining = max(1.0, timeout - (time.time() - start_time))
-                    if await asyncio.wait_for(self.connect_with_exponential_backoff(max_attempts=3), timeout=remaining):
+                    async with ble_timeout(remaining):
+                        connected = await self.connect_with_exponential_backoff(max_attempts=3)
+                    if connected:
                         return self.controller
                 except asyncio.TimeoutError:
-                    log_with_timestamp("Timed out during connect attempts")
+                    logger.info("Timed out during connect attempts")
                     
-                # Wait before retry
-                await asyncio.sleep(2)
+                # Wait before retry, cut short if the monitor reconnects in the meantime
+                await self._wait_for_connect(2)
+                if self.connected:
+                    return self.controller
                 
             except Exception as e:
                 error_msg = str(e)
                 if "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
-                    log_with_timestamp(f"Connection attempt BLE disconnection: {error_msg}")
+                    logger.info("Connection attempt BLE disconnection: %s", error_msg)
                 else:
-                    log_with_timestamp(f"Connection attempt failed: {e}")
+                    logger.info("Connection attempt failed: %s", e)
                 await asyncio.sleep(1)
         
         raise Exception(f"Unable to establish WalkingPad connection within {timeout}s timeout")
@@ -429,20 +718,25 @@ class WalkingPadConnectionManager:
 # Usage example/test
 if __name__ == "__main__":
     import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader  # LibYAML C parser when available
+    except ImportError:
+        from yaml import SafeLoader
     
     # Load config
     with open("config.yaml", 'r') as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=SafeLoader)
     
     manager = WalkingPadConnectionManager(config['address'])
     
     # Start monitoring
     manager.start_monitoring()
     
+    stop_event = threading.Event()
     try:
-        # Keep alive
-        while True:
-            time.sleep(1)
+        # Block until interrupted instead of waking up every second
+        stop_event.wait()
     except KeyboardInterrupt:
+        stop_event.set()
         manager.stop_monitoring()
         print("Monitoring stopped")
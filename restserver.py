@@ -4,19 +4,20 @@ from ph4_walkingpad.pad import WalkingPad, Controller
 from ph4_walkingpad.utils import setup_logging
 import logging
 import asyncio
-import yaml
 import psycopg2
+import psycopg2.errors
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_batch
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 import time
+import threading
+import queue
 from functools import wraps
+import copy
 from connection_manager import WalkingPadConnectionManager
-
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]  # milliseconds
-    print(f"[{timestamp}] {message}")
+from walkingpad_common import log_with_timestamp, jresp
 
 load_dotenv()
 
@@ -26,6 +27,31 @@ app = Flask(__name__)
 # This should be removed once we can take it from the controller
 minimal_cmd_space = 0.69
 
+
+class CmdSpacer:
+    """Keeps consecutive BLE commands at least `space` seconds apart"""
+
+    def __init__(self, space):
+        self.space = space
+        self.last = 0.0
+
+    async def gate(self):
+        """Wait only for whatever is left of the gap since the previous command"""
+        # Reserve the slot before sleeping so concurrent callers queue up behind each other
+        # instead of reading the same `last` and sending together
+        now = time.monotonic()
+        slot = max(now, self.last + self.space)
+        self.last = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Shared by all handlers - they drive the same pad from the monitor loop
+cmd_spacer = CmdSpacer(minimal_cmd_space)
+
+# The monitor refreshes the pad status every few seconds; reuse it if it's this recent
+status_max_age = 2.0
+
 log = setup_logging()
 pad.logger = log
 
@@ -35,71 +61,173 @@ logging.getLogger("bleak").setLevel(logging.WARNING)
 
 # Initialize connection manager
 connection_manager = None
+# Stops two concurrent first requests from each creating a manager
+connection_manager_lock = threading.Lock()
 
 last_status = {
     "steps": None,
     "distance": None,
     "time": None
 }
+# time.monotonic() when on_new_status last filled last_status
+last_record_ts = 0.0
 
 
 def on_new_status(sender, record):
+    global last_record_ts
 
     distance_in_km = record.dist / 100
-    log_with_timestamp("Received Record:")
-    log_with_timestamp('Distance: {0}km'.format(distance_in_km))
-    log_with_timestamp('Time: {0} seconds'.format(record.time))
-    log_with_timestamp('Steps: {0}'.format(record.steps))
-
     last_status['steps'] = record.steps
     last_status['distance'] = distance_in_km
     last_status['time'] = record.time
+    last_record_ts = time.monotonic()
+
+    log_with_timestamp('Received Record: {0}km, {1} seconds, {2} steps'.format(distance_in_km, record.time, record.steps))
+
+
+# Database settings, resolved once since the environment doesn't change while we run;
+# None when no database is configured
+DB_DSN = None
+if os.getenv('DB_HOST'):
+    DB_DSN = dict(
+        host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT', 5432)),
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD')
+    )
+
+# Lazily created so the server starts even when the database is unreachable
+db_pool = None
+db_pool_lock = threading.Lock()
+# Rows waiting for the background writer, so requests never block on Postgres
+db_queue = queue.Queue()
+db_writer_thread = None
+
+
+def get_db_pool():
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            # TCP keepalives so an idle pooled connection isn't silently dropped between walks
+            db_pool = ThreadedConnectionPool(1, 4, keepalives=1, keepalives_idle=30, **DB_DSN)
+        return db_pool
 
 
 def store_in_db(steps, distance_in_km, duration_in_seconds):
-    db_host = os.getenv('DB_HOST')
-    if not db_host:
+    """Queue a workout row for the background DB writer and return immediately"""
+    if DB_DSN is None:
+        return
+    if steps is None or distance_in_km is None or duration_in_seconds is None:
+        # No record from the pad yet (last_status is still empty) - nothing to save
+        log_with_timestamp("Database error: no workout data to save")
         return
 
-    conn = None
-    cur = None
+    date_today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    duration = int(duration_in_seconds / 60)
+
+    start_db_writer()
+    db_queue.put((date_today, steps, duration, distance_in_km))
+
+
+def start_db_writer():
+    global db_writer_thread
+    with db_pool_lock:
+        if db_writer_thread is None or not db_writer_thread.is_alive():
+            db_writer_thread = threading.Thread(target=db_writer, daemon=True)
+            db_writer_thread.start()
+
+
+def db_writer():
+    """Drain the queue, writing everything that has accumulated in one round-trip"""
+    while True:
+        rows = [db_queue.get()]
+        while True:
+            try:
+                rows.append(db_queue.get_nowait())
+            except queue.Empty:
+                break
+        write_rows(rows)
+
+
+def insert_rows(rows):
+    """Insert (ts, steps, duration, distance) rows in one batch on a pooled connection"""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    failed = True
     try:
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', 5432),
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        cur = conn.cursor()
-
-        date_today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        duration = int(duration_in_seconds / 60)
-
-        cur.execute(
-            "INSERT INTO exercise VALUES (%s, %s, %s, %s)",
-            (date_today, steps, duration, distance_in_km)
-        )
+        with conn.cursor() as cur:
+            try:
+                execute_batch(cur, "EXECUTE insert_exercise (%s, %s, %s, %s)", rows)
+            except psycopg2.errors.InvalidSqlStatementName:
+                # First insert on this connection: prepare once, later saves skip parse/plan
+                conn.rollback()
+                cur.execute("PREPARE insert_exercise AS INSERT INTO exercise VALUES ($1, $2, $3, $4)")
+                execute_batch(cur, "EXECUTE insert_exercise (%s, %s, %s, %s)", rows)
         conn.commit()
-
-    except Exception as e:
-        log_with_timestamp(f"Database error: {e}")
-        if conn:
-            conn.rollback()
+        failed = False
     finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        if failed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass  # Connection already gone; it's closed below
+        # Drop connections that errored so a broken session isn't handed out again
+        pool.putconn(conn, close=failed)
+
+
+def write_rows(rows):
+    max_attempts = 2
+    for attempt in range(max_attempts):
+        try:
+            insert_rows(rows)
+            return
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Usually a pooled connection the server closed while we were idle; the failed
+            # one has been discarded, so the retry gets a fresh connection
+            if attempt < max_attempts - 1:
+                log_with_timestamp(f"Database connection lost, retrying: {e}")
+                time.sleep(0.5)
+                continue
+            log_with_timestamp(f"Database error: {e}")
+        except Exception as e:
+            log_with_timestamp(f"Database error: {e}")
+            return
+
+
+# Parsed YAML files keyed by path: {path: (st_mtime_ns, st_size, parsed)}
+yaml_cache = {}
+yaml_cache_lock = threading.Lock()
+
+
+def read_yaml_cached(path):
+    """Parse a YAML file, reusing the last parse while its mtime and size are unchanged.
+
+    Callers get a deep copy so mutating the result can't corrupt the cache.
+    """
+    import yaml  # only needed without the environment config, keep it off the import path
+
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with yaml_cache_lock:
+        cached = yaml_cache.get(path)
+        if cached is None or cached[:2] != key:
+            with open(path, 'r') as stream:
+                cached = key + (yaml.safe_load(stream),)
+            yaml_cache[path] = cached
+        return copy.deepcopy(cached[2])
+
+
+# Config built from environment variables, resolved on first use
+env_config = None
 
 
 def load_config():
     # Load from environment variables first, fallback to config.yaml
-    walkingpad_address = os.getenv('WALKINGPAD_ADDRESS')
-    
-    if walkingpad_address:
-        return {
-            'address': walkingpad_address,
+    global env_config
+    if env_config is None and os.getenv('WALKINGPAD_ADDRESS'):
+        env_config = {
+            'address': os.getenv('WALKINGPAD_ADDRESS'),
             'database': {
                 'host': os.getenv('DB_HOST'),
                 'port': int(os.getenv('DB_PORT', 5432)),
@@ -108,16 +236,20 @@ def load_config():
                 'password': os.getenv('DB_PASSWORD')
             }
         }
+    if env_config is not None:
+        # Copy so callers like set_config_address can't mutate the cached config
+        return copy.deepcopy(env_config)
     
     # Fallback to config.yaml
-    with open("config.yaml", 'r') as stream:
-        try:
-            return yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
+    import yaml
+    try:
+        return read_yaml_cached("config.yaml")
+    except yaml.YAMLError as exc:
+        print(exc)
 
 
 def save_config(config):
+    import yaml
     with open('config.yaml', 'w') as outfile:
         yaml.dump(config, outfile, default_flow_style=False)
 
@@ -125,21 +257,32 @@ def save_config(config):
 def initialize_connection_manager():
     """Initialize the connection manager with auto-recovery"""
     global connection_manager
-    if connection_manager is None:
-        config = load_config()
-        connection_manager = WalkingPadConnectionManager(config['address'])
-        connection_manager.start_monitoring()
-    elif not connection_manager.is_monitoring_thread_alive():
-        log_with_timestamp("Monitor thread died, restarting...")
-        connection_manager.start_monitoring()
+    # Fast path once the monitor is running - no lock needed
+    if connection_manager is not None and connection_manager.is_monitoring_thread_alive():
+        return
+
+    with connection_manager_lock:
+        if connection_manager is None:
+            config = load_config()
+            connection_manager = WalkingPadConnectionManager(config['address'])
+            connection_manager.controller.handler_last_status = on_new_status
+            connection_manager.start_monitoring()
+        elif not connection_manager.is_monitoring_thread_alive():
+            log_with_timestamp("Monitor thread died, restarting...")
+            connection_manager.start_monitoring()
 
 
 def ble_operation(func):
     """Decorator for BLE operations with fast retry on slow connections"""
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        global connection_manager
         initialize_connection_manager()
+        # Flask runs each async view on its own loop; hand the BLE work to the monitor
+        # loop so the controller is only ever driven from the loop that owns it
+        return await connection_manager.run_on_monitor_loop(run_operation(*args, **kwargs))
+
+    async def run_operation(*args, **kwargs):
+        global connection_manager
 
         # First attempt - should be fast if connection is healthy
         start_time = time.time()
@@ -210,19 +353,78 @@ def ble_operation(func):
 
             elif "disconnected" in error_msg.lower() or "bleak" in str(type(e)).lower():
                 log_with_timestamp(f"BLE operation disconnection: {error_msg}")
-                # Mark connection as failed to trigger reconnect
+                # Mark connection as failed and wake the monitor to reconnect
                 if connection_manager:
-                    connection_manager.connected = False
+                    connection_manager.request_reconnect()
             else:
                 log_with_timestamp(f"BLE operation failed: {e}")
             return {"error": str(e)}, 500
     return wrapper
 
 
+MODE_NAMES = {
+    WalkingPad.MODE_STANDBY: "standby",
+    WalkingPad.MODE_MANUAL: "manual",
+    WalkingPad.MODE_AUTOMAT: "auto",
+}
+MODES_BY_NAME = {name: mode for mode, name in MODE_NAMES.items()}
+
+BELT_STATE_NAMES = {5: "standby", 0: "idle", 1: "running"}
+
+
+def belt_state_name(belt_state):
+    # 7 and above are the countdown states while the belt starts up
+    return BELT_STATE_NAMES.get(belt_state, "starting" if belt_state >= 7 else belt_state)
+
+
+def stats_to_dict(stats):
+    """Project a WalkingPad status record into the JSON shape returned by /status"""
+    return {
+        "dist": stats.dist / 100,
+        "time": stats.time,
+        "steps": stats.steps,
+        "speed": stats.speed / 10,
+        "belt_state": belt_state_name(stats.belt_state)
+    }
+
+
+# Status query currently in flight on the monitor loop, shared by concurrent handlers
+inflight_stats = None
+
+
+async def ask_stats_coalesced(ctler):
+    """Query the pad's status, joining the query already in flight if there is one"""
+    global inflight_stats
+    if inflight_stats is None or inflight_stats.done():
+        inflight_stats = asyncio.ensure_future(ask_stats_once(ctler))
+    # Shield it so a caller timing out doesn't cancel the query for everyone else
+    return await asyncio.shield(inflight_stats)
+
+
+async def ask_stats_once(ctler):
+    global inflight_stats
+    try:
+        await cmd_spacer.gate()
+        await ctler.ask_stats()
+        # Give the reply time to arrive before reading it
+        await asyncio.sleep(minimal_cmd_space)
+        return ctler.last_status
+    finally:
+        inflight_stats = None
+
+
+async def current_stats(ctler):
+    """Return the pad's current status, only querying the pad if the cached one is stale"""
+    if ctler.last_status is not None and connection_manager.status_age() < status_max_age:
+        return ctler.last_status
+
+    return await ask_stats_coalesced(ctler)
+
+
 @app.route("/config/address", methods=['GET'])
 def get_config_address():
-    config = load_config()
-    return str(config['address']), 200
+    address = os.environ.get('WALKINGPAD_ADDRESS') or load_config()['address']
+    return str(address), 200
 
 
 @app.route("/config/address", methods=['POST'])
@@ -238,78 +440,45 @@ def set_config_address():
 @app.route("/mode", methods=['GET'])
 @ble_operation
 async def get_pad_mode(ctler):
-    await ctler.ask_stats()
-    await asyncio.sleep(minimal_cmd_space)
-    stats = ctler.last_status
+    stats = await current_stats(ctler)
     mode = stats.manual_mode
 
-    if (mode == WalkingPad.MODE_STANDBY):
-        return "standby"
-    elif (mode == WalkingPad.MODE_MANUAL):
-        return "manual"
-    elif (mode == WalkingPad.MODE_AUTOMAT):
-        return "auto"
+    if mode in MODE_NAMES:
+        return MODE_NAMES[mode]
     else:
         return "Mode {0} not supported".format(mode), 400
 
 @app.route("/mode", methods=['POST'])
+async def change_pad_mode():
+    # Read the request here - the BLE part runs on the monitor loop, outside the request context
+    return await switch_pad_mode(request.args.get('new_mode'))
+
 @ble_operation
-async def change_pad_mode(ctler):
-    new_mode = request.args.get('new_mode')
+async def switch_pad_mode(ctler, new_mode):
     log_with_timestamp("Got mode {0}".format(new_mode))
 
-    if (new_mode.lower() == "standby"):
-        pad_mode = WalkingPad.MODE_STANDBY
-    elif (new_mode.lower() == "manual"):
-        pad_mode = WalkingPad.MODE_MANUAL
-    elif (new_mode.lower() == "auto"):
-        pad_mode = WalkingPad.MODE_AUTOMAT
-    else:
+    pad_mode = MODES_BY_NAME.get(new_mode.lower())
+    if pad_mode is None:
         return "Mode {0} not supported".format(new_mode), 400
 
+    await cmd_spacer.gate()
     await ctler.switch_mode(pad_mode)
-    await asyncio.sleep(minimal_cmd_space)
     return new_mode
 
 @app.route("/status", methods=['GET'])
 @ble_operation
 async def get_status(ctler):
-    await ctler.ask_stats()
-    await asyncio.sleep(minimal_cmd_space)
-    stats = ctler.last_status
-    mode = stats.manual_mode
-    belt_state = stats.belt_state
-
-    if (mode == WalkingPad.MODE_STANDBY):
-        mode = "standby"
-    elif (mode == WalkingPad.MODE_MANUAL):
-        mode = "manual"
-    elif (mode == WalkingPad.MODE_AUTOMAT):
-        mode = "auto"
-
-    if (belt_state == 5):
-        belt_state = "standby"
-    elif (belt_state == 0):
-        belt_state = "idle"
-    elif (belt_state == 1):
-        belt_state = "running"
-    elif (belt_state >=7):
-        belt_state = "starting"
-
-    dist = stats.dist / 100
-    time = stats.time
-    steps = stats.steps
-    speed = stats.speed / 10
-
-    return { "dist": dist, "time": time, "steps": steps, "speed": speed, "belt_state": belt_state }
+    stats = await current_stats(ctler)
+    return jresp(stats_to_dict(stats))
 
 
 @app.route("/history", methods=['GET'])
 @ble_operation
 async def get_history(ctler):
+    await cmd_spacer.gate()
     await ctler.ask_hist(0)
     await asyncio.sleep(minimal_cmd_space)
-    return last_status
+    return jresp(last_status)
 
 @app.route("/save", methods=['POST'])
 def save():
@@ -324,78 +493,57 @@ async def start_walk(ctler):
     ctler.handler_last_status = on_new_status
     
     log_with_timestamp("Step 1: Switching to STANDBY mode")
+    await cmd_spacer.gate()
     await ctler.switch_mode(WalkingPad.MODE_STANDBY) # Ensure we start from a known state, since start_belt is actually toggle_belt
-    await asyncio.sleep(minimal_cmd_space)
     
     log_with_timestamp("Step 2: Switching to MANUAL mode")  
+    await cmd_spacer.gate()
     await ctler.switch_mode(WalkingPad.MODE_MANUAL)
-    await asyncio.sleep(minimal_cmd_space)
     
     log_with_timestamp("Step 3: Starting belt")
+    await cmd_spacer.gate()
     await ctler.start_belt()
-    await asyncio.sleep(minimal_cmd_space)
     
     log_with_timestamp("Step 4: Asking for history")
+    await cmd_spacer.gate()
     await ctler.ask_hist(1)
+    # Give the history reply time to reach on_new_status before returning it
     await asyncio.sleep(minimal_cmd_space)
     
     log_with_timestamp("✅ Walk start sequence completed")
-    return last_status
+    return jresp(last_status)
 
 @app.route("/finishwalk", methods=['POST'])
 @ble_operation
 async def finish_walk(ctler):
+    await cmd_spacer.gate()
     await ctler.switch_mode(WalkingPad.MODE_STANDBY)
-    await asyncio.sleep(minimal_cmd_space)
-    await ctler.ask_hist(1)
-    await asyncio.sleep(minimal_cmd_space)
+    switched_at = time.monotonic()
+    await cmd_spacer.gate()
+    # Only a record that arrived after the STANDBY switch belongs to the session that just
+    # ended - an older one may be the previous session, fetched by /startwalk's ask_hist
+    if last_record_ts <= switched_at:
+        await ctler.ask_hist(1)
+        await asyncio.sleep(minimal_cmd_space)
     store_in_db(last_status['steps'], last_status['distance'], last_status['time'])
-    return last_status
+    return jresp(last_status)
 
 @app.route("/save_and_stop", methods=['POST'])
 @ble_operation
 async def save_and_stop(ctler):
-    await ctler.ask_stats()
-    await asyncio.sleep(minimal_cmd_space)
-    stats = ctler.last_status
-    mode = stats.manual_mode
-    belt_state = stats.belt_state
-
-    if (mode == WalkingPad.MODE_STANDBY):
-        mode = "standby"
-    elif (mode == WalkingPad.MODE_MANUAL):
-        mode = "manual"
-    elif (mode == WalkingPad.MODE_AUTOMAT):
-        mode = "auto"
-
-    if (belt_state == 5):
-        belt_state = "standby"
-    elif (belt_state == 0):
-        belt_state = "idle"
-    elif (belt_state == 1):
-        belt_state = "running"
-    elif (belt_state >=7):
-        belt_state = "starting"
-
-    dist = stats.dist / 100
-    time = stats.time
-    steps = stats.steps
-    speed = stats.speed / 10
-
-    store_in_db(steps=steps, distance_in_km=dist, duration_in_seconds=time)
+    stats = await current_stats(ctler)
+    status = stats_to_dict(stats)
+    store_in_db(steps=status["steps"], distance_in_km=status["dist"], duration_in_seconds=status["time"])
 
+    await cmd_spacer.gate()
     await ctler.switch_mode(WalkingPad.MODE_STANDBY)
-    await asyncio.sleep(minimal_cmd_space)
 
-    return last_status
+    return jresp(last_status)
 
 
 def setup_handlers():
-    """Setup handlers after connection manager is initialized"""
-    global connection_manager
+    """Start the connection manager at startup rather than on the first request"""
     initialize_connection_manager()
-    if connection_manager and connection_manager.controller:
-        connection_manager.controller.handler_last_status = on_new_status
 
 if __name__ == '__main__':
     setup_handlers()
@@ -6,55 +6,17 @@ Always: connect -> set speed -> disconnect
 
 import asyncio
 import time
-import yaml
-import os
-import json
 import signal
 import sys
-from datetime import datetime
 from ph4_walkingpad.pad import WalkingPad, Controller
-from bleak import BleakScanner
-from dotenv import load_dotenv
+from walkingpad_common import (
+    log_with_timestamp, log_metric, metric_log, load_config, ensure_advertising, run_main,
+)
 
 
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"[{timestamp}] {message}")
-
-
-def log_metric(event_type, **data):
-    """Emit structured metrics for downstream analysis"""
-    entry = {
-        "event": event_type,
-        "ts": datetime.utcnow().isoformat() + "Z",
-    }
-    entry.update(data)
-    print(f"[METRIC] {json.dumps(entry, sort_keys=True)}")
-
-
-def load_config():
-    """Load WalkingPad address from config"""
-    load_dotenv()
-
-    walkingpad_address = os.getenv('WALKINGPAD_ADDRESS')
-    if walkingpad_address:
-        return walkingpad_address
-
-    with open("config.yaml", 'r') as stream:
-        config = yaml.safe_load(stream)
-        return config['address']
-
-
-async def ensure_advertising(address, timeout=3.0):
-    """Quickly confirm the WalkingPad is advertising"""
-    try:
-        device = await BleakScanner.find_device_by_address(address, timeout=timeout)
-        return device is not None
-    except Exception as exc:
-        log_with_timestamp(f"⚠️  Advertising check failed: {exc}")
-        return False
-
+# Worst case: 2s preflight, 6s connect, the speed command and disconnect.
+# simple_server never times a run out sooner.
+RUN_BUDGET = 15
 
 async def set_speed(address, speed):
     """Connect to WalkingPad and set speed."""
@@ -115,6 +77,19 @@ async def set_speed(address, speed):
                 pass
 
 
+async def run(speed):
+    """In-process entry point: set the speed and return the result with the metrics emitted"""
+    metric_log.clear()
+    try:
+        address = load_config()
+        result = await set_speed(address, speed)
+    except Exception as e:
+        log_with_timestamp(f"Fatal error: {e}")
+        result = {"success": False, "error": str(e)}
+    result["metric_events"] = list(metric_log)
+    return result
+
+
 async def main():
     """Main entry point"""
     if len(sys.argv) < 2:
@@ -126,17 +101,11 @@ async def main():
         print(f"Speed {speed} out of range (0-60, i.e. 0-6.0 km/h)")
         sys.exit(1)
 
-    try:
-        address = load_config()
-        result = await set_speed(address, speed)
-        return result
-    except Exception as e:
-        log_with_timestamp(f"Fatal error: {e}")
-        return {"success": False, "error": str(e)}
+    return await run(speed)
 
 
 if __name__ == "__main__":
     signal.signal(signal.SIGTERM, signal.default_int_handler)
-    result = asyncio.run(main())
+    result = run_main(main())
     if not result["success"]:
         exit(1)
@@ -1,20 +1,23 @@
 #!/usr/bin/env python3
 """
 Simple Stateless WalkingPad Server
-Calls individual scripts instead of maintaining persistent connections
+Runs the individual scripts' sequences in-process instead of maintaining persistent connections
 """
 
 import asyncio
-import subprocess
-import json
-import os
-import signal
+import collections
 import sys
 import threading
-from flask import Flask, request, jsonify
+import orjson
+from flask import Flask, Response, request
 from datetime import datetime
 from dotenv import load_dotenv
 
+import start_walk as start_walk_script
+import stop_walk as stop_walk_script
+import set_speed as set_speed_script
+from walkingpad_common import log_with_timestamp, jresp
+
 load_dotenv()
 
 # Force line-buffered stdout so logs appear immediately under launchd
@@ -29,98 +32,68 @@ _ble_lock = threading.Lock()
 _last_success = {}  # {"startwalk": datetime, "save_and_stop": datetime}
 DEBOUNCE_SECONDS = 5
 
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"[{timestamp}] {message}")
-
-def extract_metrics(lines):
-    """Return parsed metric dictionaries from stdout lines"""
-    metrics = []
-    for line in lines:
-        if line.startswith('[METRIC] '):
-            payload = line[len('[METRIC] '):]
-            try:
-                metrics.append(json.loads(payload))
-            except json.JSONDecodeError as exc:
-                log_with_timestamp(f"⚠️  Failed to parse metric line: {exc}" )
-    return metrics
-
-
-def run_script(script_name):
-    """Run a WalkingPad script and return the result (single attempt)"""
+# Upper bound for one run of a script's sequence, used until enough runs have been timed
+SCRIPT_TIMEOUT = 45
+MIN_SCRIPT_TIMEOUT = 10
+MIN_TIMED_RUNS = 5
+# How long a timed-out stop may keep the BLE lock waiting for its DB/Fitbit saves
+SAVE_WAIT_TIMEOUT = 5
+# Durations of recent successful runs per script, for adaptive timeouts
+_durations = collections.defaultdict(lambda: collections.deque(maxlen=50))
+
+def script_timeout(script):
+    """Twice the p95 of recent successful runs, clamped to [MIN_SCRIPT_TIMEOUT, SCRIPT_TIMEOUT].
+
+    Never below the script's RUN_BUDGET, so a run that would still recover through its own
+    retries isn't cancelled and started over from scratch.
+    """
+    durations = _durations[script.__name__]
+    if len(durations) < MIN_TIMED_RUNS:
+        timeout = SCRIPT_TIMEOUT
+    else:
+        p95 = sorted(durations)[int(0.95 * (len(durations) - 1))]
+        timeout = min(SCRIPT_TIMEOUT, max(MIN_SCRIPT_TIMEOUT, 2.0 * p95))
+    return max(timeout, getattr(script, "RUN_BUDGET", 0))
+
+async def run_script(script, *args):
+    """Run a WalkingPad script's sequence in-process and return the result (single attempt)"""
+    script_name = script.__name__
     start_time = datetime.now()
-    log_with_timestamp(f"🏃 Running {script_name}...")
+    timeout = script_timeout(script)
+    log_with_timestamp(f"🏃 Running {script_name} (timeout {timeout:.0f}s)...")
 
     try:
-        # Use Popen so we can send SIGINT on timeout (not SIGKILL).
-        # SIGINT lets asyncio.run() cancel tasks and run finally blocks,
-        # which disconnect BLE cleanly instead of orphaning the connection.
-        proc = subprocess.Popen(
-            ["uv", "run", "python"] + script_name.split(),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            start_new_session=True,  # Own process group for clean signal delivery
-        )
-
-        try:
-            stdout, stderr = proc.communicate(timeout=45)
-        except subprocess.TimeoutExpired:
-            log_with_timestamp(f"⏱️  {script_name} timed out, sending SIGINT for graceful BLE disconnect...")
-            os.killpg(os.getpgid(proc.pid), signal.SIGINT)
-            try:
-                stdout, stderr = proc.communicate(timeout=5)
-                log_with_timestamp(f"⏱️  {script_name} shut down gracefully after SIGINT")
-            except subprocess.TimeoutExpired:
-                log_with_timestamp(f"⏱️  {script_name} didn't exit after SIGINT, sending SIGKILL...")
-                os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
-                proc.communicate()
-
-            elapsed = (datetime.now() - start_time).total_seconds()
-            return {
-                "success": False,
-                "error": f"Script timed out after {elapsed:.0f} seconds",
-                "elapsed": elapsed
-            }
-
+        # On timeout wait_for cancels the sequence, so its finally blocks still
+        # disconnect BLE cleanly instead of orphaning the connection.
+        result = await asyncio.wait_for(script.run(*args), timeout=timeout)
+    except asyncio.TimeoutError:
         elapsed = (datetime.now() - start_time).total_seconds()
-        stdout_lines = stdout.strip().split('\n') if stdout and stdout.strip() else []
-        metrics = extract_metrics(stdout_lines)
-
-        # Forward all subprocess output to server log for visibility
-        for line in stdout_lines:
-            if line.strip():
-                log_with_timestamp(f"  [{script_name}] {line}")
-
-        if proc.returncode == 0:
-            log_with_timestamp(f"✅ {script_name} completed successfully in {elapsed:.1f}s")
-            return {
-                "success": True,
-                "output": stdout,
-                "elapsed": elapsed,
-                "logs": stdout_lines,
-                "metrics": metrics
-            }
-        else:
-            err_msg = (stderr or "").strip()
-            if not err_msg:
-                last_line = ""
-                for line in stdout_lines:
-                    if line.strip():
-                        last_line = line
-                err_msg = last_line
-
-            log_with_timestamp(f"❌ {script_name} failed in {elapsed:.1f}s: {err_msg}")
-            return {
-                "success": False,
-                "error": err_msg,
-                "output": stdout,
-                "elapsed": elapsed,
-                "logs": stdout_lines,
-                "metrics": metrics
-            }
-
+        log_with_timestamp(f"⏱️  {script_name} timed out after {elapsed:.0f}s, cancelled for graceful BLE disconnect")
+        # A stop cancelled while saving has already put the pad in standby. Its save threads
+        # keep running, so let them finish instead of retrying and storing the workout twice.
+        if hasattr(script, "wait_for_saves"):
+            # Bounded, since we still hold the BLE lock; shielded so expiring doesn't cancel
+            # a save that hasn't started yet
+            try:
+                saved = await asyncio.wait_for(asyncio.shield(script.wait_for_saves()), timeout=SAVE_WAIT_TIMEOUT)
+                output = "Walk stopped"
+            except asyncio.TimeoutError:
+                saved = "pending"
+                output = "Walk stopped, saves still pending"
+            if saved is not None:
+                elapsed = (datetime.now() - start_time).total_seconds()
+                log_with_timestamp(f"💾 {script_name} had already stopped the pad, saves (db, fitbit): {saved}")
+                return {
+                    "success": True,
+                    "output": output,
+                    "elapsed": elapsed,
+                    "metrics": list(script.metric_log)
+                }
+        return {
+            "success": False,
+            "error": f"Script timed out after {elapsed:.0f} seconds",
+            "elapsed": elapsed
+        }
     except Exception as e:
         elapsed = (datetime.now() - start_time).total_seconds()
         log_with_timestamp(f"💥 {script_name} crashed in {elapsed:.1f}s: {e}")
@@ -130,8 +103,32 @@ def run_script(script_name):
             "elapsed": elapsed
         }
 
-def run_script_with_retries(script_name, max_retries=3):
+    elapsed = (datetime.now() - start_time).total_seconds()
+    metrics = result.get("metric_events", [])
+
+    if result["success"]:
+        _durations[script_name].append(elapsed)
+        log_with_timestamp(f"✅ {script_name} completed successfully in {elapsed:.1f}s")
+        return {
+            "success": True,
+            "output": result.get("message", ""),
+            "elapsed": elapsed,
+            "metrics": metrics
+        }
+    else:
+        err_msg = result.get("error", "")
+        log_with_timestamp(f"❌ {script_name} failed in {elapsed:.1f}s: {err_msg}")
+        return {
+            "success": False,
+            "error": err_msg,
+            "output": "",
+            "elapsed": elapsed,
+            "metrics": metrics
+        }
+
+async def run_script_with_retries(script, *args, max_retries=3):
     """Run a WalkingPad script with server-level retries"""
+    script_name = script.__name__
     overall_start_time = datetime.now()
     log_with_timestamp(f"🔄 Starting {script_name} with up to {max_retries} retries...")
 
@@ -142,7 +139,7 @@ def run_script_with_retries(script_name, max_retries=3):
         attempt_num = attempt + 1
         log_with_timestamp(f"🎯 Attempt {attempt_num}/{max_retries} for {script_name}")
 
-        result = run_script(script_name)
+        result = await run_script(script, *args)
         last_result = result
 
         # Collect metrics from all attempts
@@ -158,7 +155,6 @@ def run_script_with_retries(script_name, max_retries=3):
                 "success": True,
                 "output": result["output"],
                 "elapsed": overall_elapsed,
-                "logs": result.get("logs", []),
                 "metrics": all_metrics,
                 "attempts": attempt_num
             }
@@ -168,8 +164,7 @@ def run_script_with_retries(script_name, max_retries=3):
                 retry_delay = 2 * attempt_num  # 2s, 4s delays
                 log_with_timestamp(f"⚠️  Attempt {attempt_num} failed: {result.get('error', 'Unknown error')}")
                 log_with_timestamp(f"⏳ Waiting {retry_delay}s before retry...")
-                import time
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
             else:
                 log_with_timestamp(f"💀 All {max_retries} attempts failed for {script_name}")
 
@@ -180,24 +175,23 @@ def run_script_with_retries(script_name, max_retries=3):
         "error": last_result.get("error", "All retry attempts failed"),
         "output": last_result.get("output", ""),
         "elapsed": overall_elapsed,
-        "logs": last_result.get("logs", []),
         "metrics": all_metrics,
         "attempts": max_retries
     }
 
 @app.route("/startwalk", methods=['POST'])
-def start_walk():
+async def start_walk():
     """Start walking by calling the stateless script with retries"""
     last = _last_success.get("startwalk")
     if last and (datetime.now() - last).total_seconds() < DEBOUNCE_SECONDS:
         log_with_timestamp("⚠️  Debounced /startwalk — already started recently")
-        return jsonify({"message": "Walk already started", "debounced": True}), 200
+        return jresp({"message": "Walk already started", "debounced": True}), 200
     if not _ble_lock.acquire(blocking=False):
         log_with_timestamp("⚠️  Rejected /startwalk — another BLE operation in progress")
-        return jsonify({"error": "Another BLE operation is in progress. Please wait."}), 409
+        return jresp({"error": "Another BLE operation is in progress. Please wait."}), 409
     try:
         log_with_timestamp("📥 Received start walk request")
-        result = run_script_with_retries("start_walk.py", max_retries=3)
+        result = await run_script_with_retries(start_walk_script, max_retries=3)
 
         response_payload = {
             "elapsed": result.get("elapsed", 0),
@@ -209,26 +203,26 @@ def start_walk():
             _last_success["startwalk"] = datetime.now()
             _last_success.pop("save_and_stop", None)  # Clear stop debounce on new start
             response_payload["message"] = "Walk started successfully"
-            return jsonify(response_payload), 200
+            return jresp(response_payload), 200
         else:
             response_payload["error"] = result.get("error", "")
-            return jsonify(response_payload), 500
+            return jresp(response_payload), 500
     finally:
         _ble_lock.release()
 
 @app.route("/save_and_stop", methods=['POST'])
-def save_and_stop():
+async def save_and_stop():
     """Stop walking and save to database by calling the stateless script with retries"""
     last = _last_success.get("save_and_stop")
     if last and (datetime.now() - last).total_seconds() < DEBOUNCE_SECONDS:
         log_with_timestamp("⚠️  Debounced /save_and_stop — already stopped recently")
-        return jsonify({"message": "Walk already stopped", "debounced": True}), 200
+        return jresp({"message": "Walk already stopped", "debounced": True}), 200
     if not _ble_lock.acquire(blocking=False):
         log_with_timestamp("⚠️  Rejected /save_and_stop — another BLE operation in progress")
-        return jsonify({"error": "Another BLE operation is in progress. Please wait."}), 409
+        return jresp({"error": "Another BLE operation is in progress. Please wait."}), 409
     try:
         log_with_timestamp("📥 Received save and stop request")
-        result = run_script_with_retries("stop_walk.py", max_retries=3)
+        result = await run_script_with_retries(stop_walk_script, max_retries=3)
 
         response_payload = {
             "elapsed": result.get("elapsed", 0),
@@ -241,19 +235,19 @@ def save_and_stop():
             _last_success["save_and_stop"] = datetime.now()
             _last_success.pop("startwalk", None)  # Clear start debounce on stop
             response_payload["message"] = "Walk stopped and saved successfully"
-            return jsonify(response_payload), 200
+            return jresp(response_payload), 200
         else:
             response_payload["error"] = result.get("error", "")
-            return jsonify(response_payload), 500
+            return jresp(response_payload), 500
     finally:
         _ble_lock.release()
 
 @app.route("/speed", methods=['POST'])
-def set_speed():
+async def set_speed():
     """Set walking speed"""
     if not _ble_lock.acquire(blocking=False):
         log_with_timestamp("⚠️  Rejected /speed — another BLE operation in progress")
-        return jsonify({"error": "Another BLE operation is in progress. Please wait."}), 409
+        return jresp({"error": "Another BLE operation is in progress. Please wait."}), 409
     try:
         # Accept speed from JSON body, query param, or form data
         speed = None
@@ -262,51 +256,59 @@ def set_speed():
         if speed is None:
             speed = request.args.get("speed") or request.form.get("speed")
         if speed is None:
-            return jsonify({"error": "Missing 'speed' parameter (0-60, in 0.1 km/h units, e.g. 30 = 3.0 km/h)"}), 400
+            return jresp({"error": "Missing 'speed' parameter (0-60, in 0.1 km/h units, e.g. 30 = 3.0 km/h)"}), 400
 
         speed = int(speed)
         if speed < 0 or speed > 60:
-            return jsonify({"error": f"Speed {speed} out of range (0-60, i.e. 0-6.0 km/h)"}), 400
+            return jresp({"error": f"Speed {speed} out of range (0-60, i.e. 0-6.0 km/h)"}), 400
 
         log_with_timestamp(f"📥 Received set speed request: {speed} ({speed/10.0:.1f} km/h)")
-        result = run_script_with_retries(f"set_speed.py {speed}", max_retries=2)
+        result = await run_script_with_retries(set_speed_script, speed, max_retries=2)
 
         if result["success"]:
-            return jsonify({"message": f"Speed set to {speed/10.0:.1f} km/h", "speed": speed}), 200
+            return jresp({"message": f"Speed set to {speed/10.0:.1f} km/h", "speed": speed}), 200
         else:
-            return jsonify({"error": result.get("error", "")}), 500
+            return jresp({"error": result.get("error", "")}), 500
     finally:
         _ble_lock.release()
 
+# The status and health bodies never change, so they are serialised once
+STATUS_RESPONSE = Response(orjson.dumps({
+    "status": "Simple stateless WalkingPad server",
+    "approach": "discover-connect-command-disconnect",
+    "version": "2.0-stateless"
+}), mimetype='application/json')
+HEALTH_RESPONSE = Response(b'{"status": "healthy"}', mimetype='application/json')
+
 @app.route("/status", methods=['GET'])
 def status():
     """Simple status endpoint"""
-    return jsonify({
-        "status": "Simple stateless WalkingPad server",
-        "approach": "discover-connect-command-disconnect",
-        "version": "2.0-stateless"
-    }), 200
+    return STATUS_RESPONSE, 200
 
 @app.route("/health", methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "healthy"}), 200
+    return HEALTH_RESPONSE, 200
 
 # Legacy endpoints for compatibility
 @app.route("/finishwalk", methods=['POST'])
-def finish_walk():
+async def finish_walk():
     """Legacy endpoint - redirects to save_and_stop"""
-    return save_and_stop()
+    return await save_and_stop()
+
+def warm_db_pool():
+    """Open the save path's DB connection now rather than during the first /save_and_stop"""
+    if stop_walk_script.DB_DSN is None:
+        return
+    try:
+        stop_walk_script.get_db_pool()
+        log_with_timestamp("✅ Database connection pool ready")
+    except Exception as e:
+        log_with_timestamp(f"⚠️  Database warm-up failed, will retry on first save: {e}")
 
 if __name__ == '__main__':
     log_with_timestamp("🚀 Starting Simple Stateless WalkingPad Server")
     log_with_timestamp("📋 Approach: Always discover → connect → command → disconnect")
-
-    # Check if scripts exist
-    for script in ["start_walk.py", "stop_walk.py", "set_speed.py"]:
-        if not os.path.exists(script):
-            log_with_timestamp(f"❌ Missing script: {script}")
-            sys.exit(1)
-
-    log_with_timestamp("✅ All scripts found")
+    # In the background so an unreachable database doesn't hold up the server
+    threading.Thread(target=warm_db_pool, daemon=True).start()
     app.run(debug=False, use_reloader=False, host='0.0.0.0', port=5678, processes=1, threaded=True)
@@ -6,91 +6,18 @@ Always: discover -> connect -> start -> disconnect
 
 import asyncio
 import time
-import yaml
-import os
-import json
-from datetime import datetime
 from ph4_walkingpad.pad import WalkingPad, Controller
-from ph4_walkingpad.utils import setup_logging
-from bleak import BleakScanner
-from dotenv import load_dotenv
 import signal
-import sys
-
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"[{timestamp}] {message}")
-
-
-def log_metric(event_type, **data):
-    """Emit structured metrics for downstream analysis"""
-    entry = {
-        "event": event_type,
-        "ts": datetime.utcnow().isoformat() + "Z",
-    }
-    entry.update(data)
-    print(f"[METRIC] {json.dumps(entry, sort_keys=True)}")
-
-
-def reset_bleak_cache():
-    """Force clear Bleak's internal BLE adapter state"""
-    try:
-        log_with_timestamp("🔄 Resetting Bleak BLE cache after connection failure...")
-
-        # Clear Bleak's global scanner instances
-        import bleak
-        if hasattr(bleak, '_scanner_backends'):
-            bleak._scanner_backends.clear()
-
-        # Force garbage collection to clear any lingering BLE state
-        import gc
-        gc.collect()
-
-        log_with_timestamp("✅ Bleak cache reset complete")
-        return True
-    except Exception as e:
-        log_with_timestamp(f"⚠️  Bleak reset failed: {e}")
-        return False
-
-def load_config():
-    """Load WalkingPad address from config"""
-    load_dotenv()
-
-    walkingpad_address = os.getenv('WALKINGPAD_ADDRESS')
-    if walkingpad_address:
-        return walkingpad_address
-
-    # Fallback to config.yaml
-    with open("config.yaml", 'r') as stream:
-        config = yaml.safe_load(stream)
-        return config['address']
-
-async def discover_walkingpad(address, timeout=15):
-    """Discover the WalkingPad device"""
-    discover_start = time.time()
-    log_with_timestamp(f"🔍 Discovering WalkingPad {address}...")
-
-    devices = await BleakScanner.discover(timeout=timeout)
-    discover_elapsed = time.time() - discover_start
-    log_with_timestamp(f"⏱️  Discovery completed in {discover_elapsed:.1f}s - found {len(devices)} devices")
-
-    for device in devices:
-        if device.address.upper() == address.upper():
-            log_with_timestamp(f"✅ Found WalkingPad: {device.name} ({device.address})")
-            return device
-
-    raise Exception(f"WalkingPad {address} not found in {len(devices)} discovered devices")
-
-async def ensure_advertising(address, timeout=3.0):
-    """Quickly confirm the WalkingPad is advertising"""
-    try:
-        device = await BleakScanner.find_device_by_address(address, timeout=timeout)
-        return device is not None
-    except Exception as exc:
-        log_with_timestamp(f"⚠️  Advertising check failed: {exc}")
-        return False
+from walkingpad_common import (
+    log_with_timestamp, log_metric, metric_log, reset_bleak_cache, load_config,
+    cached_device, forget_device, discover_walkingpad, ensure_advertising, run_main,
+    is_unrecoverable,
+)
 
+# Worst case of start_walking with its retry taken: preflight 2s, 4s first attempt, disconnect
+# 3s, reset pause, 6s discovery, 10s second attempt, the start commands and disconnect.
+# simple_server never times a run out sooner.
+RUN_BUDGET = 35
 
 async def start_walking(address):
     """Complete start walking sequence with BLE reset fallback"""
@@ -106,11 +33,17 @@ async def start_walking(address):
         "advertising": None,
     }
 
-    step_start = time.time()
-    advertising_present = await ensure_advertising(address, timeout=2.0)
-    metrics["advertising"] = advertising_present
-    log_with_timestamp(f"📡 Device advertising: {advertising_present} ({time.time() - step_start:.1f}s)")
-    log_metric("preflight", advertising=advertising_present, elapsed=round(time.time() - step_start, 2))
+    # A sighting earlier in this run is all the preflight would tell us, so connect straight away.
+    # Otherwise the preflight is the scan connecting needs anyway, and it hands controller.run a
+    # BLEDevice. The cache is per event loop, so each simple_server request does its own check.
+    if cached_device(address) is None:
+        step_start = time.time()
+        advertising_present = await ensure_advertising(address, timeout=2.0)
+        metrics["advertising"] = advertising_present
+        log_with_timestamp(f"📡 Device advertising: {advertising_present} ({time.time() - step_start:.1f}s)")
+        log_metric("preflight", advertising=advertising_present, elapsed=round(time.time() - step_start, 2))
+    else:
+        log_with_timestamp("📡 WalkingPad seen recently, skipping advertising check")
 
     for attempt in range(max_attempts):
         try:
@@ -129,7 +62,8 @@ async def start_walking(address):
             controller = Controller()
             controller.log_messages_info = False
             timeout_seconds = first_timeout if attempt == 0 else retry_timeout
-            await asyncio.wait_for(controller.run(address), timeout=timeout_seconds)
+            # A cached BLEDevice lets bleak connect without scanning for the address again
+            await asyncio.wait_for(controller.run(cached_device(address) or address), timeout=timeout_seconds)
             connect_elapsed = time.time() - connect_start
             log_with_timestamp(f"⏱️  Connection completed in {connect_elapsed:.1f}s")
             attempt_record["connect_time"] = round(connect_elapsed, 2)
@@ -145,7 +79,7 @@ async def start_walking(address):
                 "attempt": attempt + 1,
                 "start_ts": start_time,
             })
-            if attempt == 0:  # First attempt failed
+            if attempt == 0 and not is_unrecoverable(e):  # First attempt failed, worth a retry
                 error_name = type(e).__name__
                 error_text = repr(e)
                 attempt_record["status"] = "timeout"
@@ -159,8 +93,9 @@ async def start_walking(address):
                     await asyncio.wait_for(controller.disconnect(), timeout=3.0)
                 except Exception:
                     pass
-                # Reset Bleak cache and try again
+                # Reset Bleak cache and try again with a freshly discovered device
                 reset_bleak_cache()
+                forget_device(address)
                 await asyncio.sleep(0.5)  # Brief pause after reset
                 try:
                     discovery_start = time.time()
@@ -172,16 +107,20 @@ async def start_walking(address):
                     log_metric("discovery", found=False, error=type(discover_error).__name__)
                 continue
             else:
-                # Second attempt also failed
+                # Second attempt also failed, or a retry can't help
+                unrecoverable = is_unrecoverable(e)
                 elapsed = time.time() - start_time
                 error_name = type(e).__name__
                 error_text = repr(e)
-                attempt_record["status"] = "failed"
+                attempt_record["status"] = "unrecoverable" if unrecoverable else "failed"
                 attempt_record["error_type"] = error_name
                 attempt_record["error_text"] = error_text
                 metrics["attempts"].append(attempt_record)
-                log_with_timestamp(f"❌ Start walk failed after BLE reset attempt: {error_text}")
-                log_metric("connection", attempt=attempt_no, status="failed", error=error_name, elapsed=elapsed)
+                if unrecoverable:
+                    log_with_timestamp(f"❌ Start walk failed, not retrying: {error_text}")
+                else:
+                    log_with_timestamp(f"❌ Start walk failed after BLE reset attempt: {error_text}")
+                log_metric("connection", attempt=attempt_no, status=attempt_record["status"], error=error_name, elapsed=elapsed)
                 # Disconnect failed controller before returning
                 try:
                     await asyncio.wait_for(controller.disconnect(), timeout=3.0)
@@ -250,10 +189,17 @@ async def main():
         log_with_timestamp(f"Fatal error: {e}")
         return {"success": False, "error": str(e)}
 
+async def run():
+    """In-process entry point: run the start sequence and return its result with the metrics emitted"""
+    metric_log.clear()
+    result = await main()
+    result["metric_events"] = list(metric_log)
+    return result
+
 if __name__ == "__main__":
-    # Convert SIGTERM to KeyboardInterrupt so asyncio.run() triggers finally blocks
+    # Convert SIGTERM to KeyboardInterrupt so run_main() triggers finally blocks
     # (which disconnect BLE cleanly instead of orphaning the connection)
     signal.signal(signal.SIGTERM, signal.default_int_handler)
-    result = asyncio.run(main())
+    result = run_main(main())
     if not result["success"]:
         exit(1)
@@ -5,120 +5,155 @@ Always: discover -> connect -> stop -> save to DB -> disconnect
 """
 
 import asyncio
+import atexit
 import time
-import yaml
 import os
 import signal
-import psycopg2
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from ph4_walkingpad.pad import WalkingPad, Controller
 from ph4_walkingpad.utils import setup_logging
-from bleak import BleakScanner
 from dotenv import load_dotenv
+from walkingpad_common import (
+    log_with_timestamp, log_metric, metric_log, reset_bleak_cache, load_config,
+    cached_device, forget_device, discover_walkingpad, ensure_advertising, backoff_delay,
+    run_main, is_unrecoverable,
+)
 
 # Performance Configuration - Optimized for reliability
 PERFORMANCE_CONFIG = {
     "connection_timeout": 8.0,
     "stats_retries": 3,
     "stats_timeout": 3.0,
-    "stats_sleep": 0.5,
+    "stats_sleep": 0.5,  # longest wait for the reply to ask_stats
     "retry_sleep": 1.0,
     "command_timeout": 3.0,
     "disconnect_timeout": 3.0,
     "name": "OPTIMIZED"
 }
 
-def log_with_timestamp(message):
-    """Print message with timestamp"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-    print(f"[{timestamp}] {message}")
-
-def log_metric(event_type, **data):
-    """Emit structured metrics for downstream analysis"""
-    import json
-    entry = {
-        "event": event_type,
-        "ts": datetime.utcnow().isoformat() + "Z",
-    }
-    entry.update(data)
-    print(f"[METRIC] {json.dumps(entry, sort_keys=True)}")
-
-def reset_bleak_cache():
-    """Force clear Bleak's internal BLE adapter state (helps intermittent failures)."""
+# Worst case of the sequence below, with every retry taken: preflight 2s, three connect
+# attempts (discovery 3/8/8s + connect 8s + disconnect 3s + backoff), three stats asks,
+# the stop commands and the final disconnect. simple_server never times a run out sooner.
+RUN_BUDGET = 80
+
+# The DB and Fitbit saves of the current run. They are plain threads, so they keep going if
+# the run is cancelled; callers use wait_for_saves() rather than stop (and save) again.
+save_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="workout-save")
+save_futures = []
+
+# .env has to be loaded before the database settings below are read
+load_dotenv()
+
+# Database settings, resolved once since the environment doesn't change while we run;
+# None when no database is configured
+DB_DSN = None
+if os.getenv('DB_HOST'):
+    DB_DSN = dict(
+        host=os.getenv('DB_HOST'),
+        port=int(os.getenv('DB_PORT', 5432)),
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD')
+    )
+
+# Created on first save; lets simple_server reuse DB connections across in-process runs
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Return the shared connection pool, creating it on first use"""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            # TCP keepalives so an idle pooled connection isn't silently dropped between walks
+            db_pool = ThreadedConnectionPool(1, 4, keepalives=1, keepalives_idle=30, **DB_DSN)
+            atexit.register(db_pool.closeall)
+        return db_pool
+
+def insert_workout(row):
+    """Insert one (ts, steps, duration, distance) row on a pooled connection"""
+    import psycopg2
+    import psycopg2.errors
+    pool = get_db_pool()
+    conn = pool.getconn()
+    failed = True
     try:
-        log_with_timestamp("🔄 Resetting Bleak BLE cache after connection failure...")
-
-        # Clear Bleak's global scanner instances
-        import bleak
-        if hasattr(bleak, '_scanner_backends'):
-            bleak._scanner_backends.clear()
-
-        # Force garbage collection to clear any lingering BLE state
-        import gc
-        gc.collect()
-
-        log_with_timestamp("✅ Bleak cache reset complete")
-        return True
-    except Exception as e:
-        log_with_timestamp(f"⚠️  Bleak reset failed: {e}")
-        return False
-
-def load_config():
-    """Load WalkingPad address from config"""
-    load_dotenv()
-
-    walkingpad_address = os.getenv('WALKINGPAD_ADDRESS')
-    if walkingpad_address:
-        return walkingpad_address
-
-    # Fallback to config.yaml
-    with open("config.yaml", 'r') as stream:
-        config = yaml.safe_load(stream)
-        return config['address']
+        with conn.cursor() as cur:
+            try:
+                cur.execute("EXECUTE insert_exercise (%s, %s, %s, %s)", row)
+            except psycopg2.errors.InvalidSqlStatementName:
+                # First insert on this connection: prepare once, later saves skip parse/plan
+                conn.rollback()
+                cur.execute("PREPARE insert_exercise AS INSERT INTO exercise VALUES ($1, $2, $3, $4)")
+                cur.execute("EXECUTE insert_exercise (%s, %s, %s, %s)", row)
+        conn.commit()
+        failed = False
+    finally:
+        if failed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        # Drop connections that errored so a broken session isn't handed out again
+        pool.putconn(conn, close=failed)
 
 def store_in_db(steps, distance_in_km, duration_in_seconds):
     """Store workout data in database"""
-    db_host = os.getenv('DB_HOST')
-    if not db_host:
+    if DB_DSN is None:
         log_with_timestamp("No database configured, skipping save")
         return False
 
-    conn = None
-    cur = None
-    try:
-        log_with_timestamp(f"💾 Saving to database: {steps} steps, {distance_in_km:.2f}km, {duration_in_seconds}s")
-
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT', 5432),
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        cur = conn.cursor()
-
-        date_today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        duration = int(duration_in_seconds / 60)
-
-        cur.execute(
-            "INSERT INTO exercise VALUES (%s, %s, %s, %s)",
-            (date_today, steps, duration, distance_in_km)
-        )
-        conn.commit()
-        log_with_timestamp("✅ Workout saved to database")
-        return True
+    # Imported here so stops without a database never load libpq
+    import psycopg2
 
-    except Exception as e:
-        log_with_timestamp(f"❌ Database error: {e}")
-        if conn:
-            conn.rollback()
-        return False
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+    log_with_timestamp(f"💾 Saving to database: {steps} steps, {distance_in_km:.2f}km, {duration_in_seconds}s")
+    date_today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    duration = int(duration_in_seconds / 60)
+    row = (date_today, steps, duration, distance_in_km)
+
+    max_attempts = 2
+    for attempt in range(max_attempts):
+        try:
+            insert_workout(row)
+            log_with_timestamp("✅ Workout saved to database")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Usually a pooled connection the server closed while we were idle; the failed
+            # one has been discarded, so the retry gets a fresh connection
+            if attempt < max_attempts - 1:
+                log_with_timestamp(f"⚠️  Database connection lost, retrying: {e}")
+                time.sleep(backoff_delay(attempt))
+                continue
+            log_with_timestamp(f"❌ Database error: {e}")
+        except Exception as e:
+            log_with_timestamp(f"❌ Database error: {e}")
+            break
+    return False
+
+# Kept across in-process runs so later Fitbit POSTs reuse the keep-alive TLS connection
+fitbit_session = None
+
+def get_fitbit_session():
+    """Return the shared Fitbit session, creating it on first use"""
+    global fitbit_session
+    if fitbit_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util import Retry
+        # Only retry what the API can't have acted on: failed connects, 429 and 503.
+        # Read errors and other 5xx may already have logged the activity. Fitbit's 429
+        # Retry-After can be up to an hour, which would hold /save_and_stop and the BLE lock,
+        # so use our own short backoff instead of honouring it.
+        retry = Retry(total=3, connect=3, read=0, backoff_factor=0.5,
+                      status_forcelist=[429, 503], allowed_methods={"POST"}, raise_on_status=False,
+                      respect_retry_after_header=False)
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry))
+        fitbit_session = session
+    return fitbit_session
 
 def log_to_fitbit(steps, duration_minutes, start_time_str):
     """Log walking activity to Fitbit"""
@@ -147,7 +182,7 @@ def log_to_fitbit(steps, duration_minutes, start_time_str):
             'Content-Type': 'application/x-www-form-urlencoded'
         }
 
-        response = requests.post(url, headers=headers, data=data)
+        response = get_fitbit_session().post(url, headers=headers, data=data, timeout=(3.05, 10))
 
         if response.status_code == 401:
             log_with_timestamp("⚠️  Fitbit token expired, run setup_fitbit_oauth.py")
@@ -165,34 +200,69 @@ def log_to_fitbit(steps, duration_minutes, start_time_str):
         log_with_timestamp(f"❌ Fitbit logging failed: {e}")
         return False
 
-async def discover_walkingpad(address, timeout=15):
-    """Discover the WalkingPad device"""
-    log_with_timestamp(f"🔍 Discovering WalkingPad {address}...")
-
-    devices = await BleakScanner.discover(timeout=timeout)
-
-    for device in devices:
-        if device.address.upper() == address.upper():
-            log_with_timestamp(f"✅ Found WalkingPad: {device.name} ({device.address})")
-            return device
+def save_workout_to_db(workout_data):
+    """Store the workout, logging how long it took"""
+    step_start = time.time()
+    db_success = store_in_db(
+        workout_data["steps"],
+        workout_data["distance"],
+        workout_data["time"]
+    )
+    db_elapsed = time.time() - step_start
+    log_with_timestamp(f"    ⏱️  DB save: {db_elapsed:.1f}s")
+    log_metric("db_save", elapsed=round(db_elapsed, 2), success=db_success)
+    return db_success
+
+def save_workout_to_fitbit(workout_data, workout_end):
+    """Log the workout to Fitbit if it has any steps, logging how long it took"""
+    if workout_data["steps"] <= 0 or workout_data["time"] <= 0:
+        return False
 
-    raise Exception(f"WalkingPad {address} not found in {len(devices)} discovered devices")
+    # Calculate workout start time (workout end time minus workout duration)
+    workout_duration_seconds = workout_data["time"]
+    workout_start_time = workout_end - timedelta(seconds=workout_duration_seconds)
+    start_time_str = workout_start_time.strftime("%H:%M")
+    duration_minutes = max(1, round(workout_duration_seconds / 60))  # At least 1 minute
 
-async def ensure_advertising(address, timeout=3.0):
-    """Quickly confirm the WalkingPad is advertising"""
+    step_start = time.time()
+    fitbit_success = log_to_fitbit(
+        workout_data["steps"],
+        duration_minutes,
+        start_time_str
+    )
+    fitbit_elapsed = time.time() - step_start
+    log_with_timestamp(f"    ⏱️  Fitbit: {fitbit_elapsed:.1f}s")
+    log_metric("fitbit", elapsed=round(fitbit_elapsed, 2), success=fitbit_success)
+    return fitbit_success
+
+async def ask_stats_and_wait(controller, timeout, reply_timeout):
+    """Ask for the current status and return as soon as the pad's reply arrives.
+
+    The reply is delivered through controller.handler_cur_status, so we hook it for
+    the duration of the request instead of sleeping for a fixed worst case.
+    """
+    received = asyncio.Event()
+    previous = controller.handler_cur_status
+
+    def on_status(sender, status):
+        received.set()
+        if previous:
+            previous(sender, status)
+
+    controller.handler_cur_status = on_status
     try:
-        from bleak import BleakScanner
-        device = await BleakScanner.find_device_by_address(address, timeout=timeout)
-        return device is not None
-    except Exception as exc:
-        log_with_timestamp(f"⚠️  Advertising check failed: {exc}")
-        return False
+        await asyncio.wait_for(controller.ask_stats(), timeout=timeout)
+        try:
+            await asyncio.wait_for(received.wait(), timeout=reply_timeout)
+        except asyncio.TimeoutError:
+            pass  # Caller checks last_status and retries
+    finally:
+        controller.handler_cur_status = previous
 
 async def stop_walking(address):
     """Complete stop walking sequence with database save, with retries/timeouts."""
     start_time = time.time()
     workout_data = {"steps": 0, "distance": 0.0, "time": 0}
-    workout_start_time = None  # Track actual workout start time
 
     log_with_timestamp(f"🚀 Using {PERFORMANCE_CONFIG['name']} performance config")
 
@@ -207,6 +277,9 @@ async def stop_walking(address):
     controller.log_messages_info = False
 
     max_attempts = 3  # Increase attempts since pad is running
+    # Short first scan - a live pad advertises well within it - then a longer one if that missed
+    discovery_timeouts = [3, 8]
+    discoveries = 0
     for attempt in range(max_attempts):
         try:
             if attempt > 0:
@@ -216,14 +289,17 @@ async def stop_walking(address):
             if attempt > 0 or not advertising_present:
                 try:
                     log_with_timestamp(f"🔍 Quick discovery for running pad...")
-                    await discover_walkingpad(address, timeout=5)
+                    timeout = discovery_timeouts[min(discoveries, len(discovery_timeouts) - 1)]
+                    discoveries += 1
+                    await discover_walkingpad(address, timeout=timeout)
                     log_with_timestamp(f"✅ Discovery successful")
                 except Exception as discovery_error:
                     log_with_timestamp(f"⚠️  Discovery failed: {discovery_error}")
 
             log_with_timestamp(f"📱 Connecting to WalkingPad {address}...")
             connect_start = time.time()
-            await asyncio.wait_for(controller.run(address), timeout=PERFORMANCE_CONFIG["connection_timeout"])
+            # A cached BLEDevice lets bleak connect without scanning for the address again
+            await asyncio.wait_for(controller.run(cached_device(address) or address), timeout=PERFORMANCE_CONFIG["connection_timeout"])
             connect_elapsed = time.time() - connect_start
             log_with_timestamp(f"⏱️  Connection completed in {connect_elapsed:.1f}s")
             break
@@ -231,14 +307,22 @@ async def stop_walking(address):
             error_msg = str(e)
             log_with_timestamp(f"⚠️  Attempt {attempt + 1} failed: {error_msg}")
 
+            if is_unrecoverable(e):
+                elapsed = time.time() - start_time
+                log_with_timestamp(f"❌ Unrecoverable connection error ({type(e).__name__}), not retrying")
+                log_metric("connection", attempt=attempt + 1, status="unrecoverable", error=type(e).__name__)
+                return {"success": False, "error": f"Unrecoverable: {error_msg}", "time": elapsed, "workout": workout_data}
+
             if attempt < max_attempts - 1:  # Not the last attempt
                 # Disconnect failed controller before retry (prevents orphaned BLE connection)
                 try:
                     await asyncio.wait_for(controller.disconnect(), timeout=3.0)
                 except Exception:
                     pass
-                reset_bleak_cache()
-                await asyncio.sleep(PERFORMANCE_CONFIG["retry_sleep"] * (attempt + 1))  # Progressive delay
+                # Full collection only before the final attempt, when cheaper resets haven't helped
+                reset_bleak_cache(gc_level=2 if attempt == max_attempts - 2 else 0)
+                forget_device(address)
+                await asyncio.sleep(backoff_delay(attempt, base=PERFORMANCE_CONFIG["retry_sleep"], cap=PERFORMANCE_CONFIG["command_timeout"]))
                 continue
             else:
                 elapsed = time.time() - start_time
@@ -255,8 +339,7 @@ async def stop_walking(address):
         for attempt in range(PERFORMANCE_CONFIG["stats_retries"]):
             try:
                 ask_start = time.time()
-                await asyncio.wait_for(controller.ask_stats(), timeout=PERFORMANCE_CONFIG["stats_timeout"])
-                await asyncio.sleep(PERFORMANCE_CONFIG["stats_sleep"])  # Give time for response
+                await ask_stats_and_wait(controller, PERFORMANCE_CONFIG["stats_timeout"], PERFORMANCE_CONFIG["stats_sleep"])
                 ask_elapsed = time.time() - ask_start
 
                 if hasattr(controller, 'last_status') and controller.last_status:
@@ -277,7 +360,7 @@ async def stop_walking(address):
                 log_with_timestamp(f"⚠️  Attempt {attempt + 1} failed: {e} ({time.time() - ask_start:.1f}s)")
 
             if attempt < PERFORMANCE_CONFIG["stats_retries"] - 1:  # Don't sleep after last attempt
-                await asyncio.sleep(PERFORMANCE_CONFIG["retry_sleep"])
+                await asyncio.sleep(backoff_delay(attempt, cap=PERFORMANCE_CONFIG["retry_sleep"]))
 
         stats_elapsed = time.time() - stats_start
         # Final check - if we still don't have valid stats, warn but continue
@@ -303,36 +386,11 @@ async def stop_walking(address):
         log_with_timestamp(f"    ⏱️  History: {time.time() - step_start:.1f}s")
         log_metric("stop_commands", standby=round(time.time() - step_start, 2))
 
-        # Step 4: Save to database
-        step_start = time.time()
-        db_success = store_in_db(
-            workout_data["steps"],
-            workout_data["distance"],
-            workout_data["time"]
-        )
-        db_elapsed = time.time() - step_start
-        log_with_timestamp(f"    ⏱️  DB save: {db_elapsed:.1f}s")
-        log_metric("db_save", elapsed=round(db_elapsed, 2), success=db_success)
-
-        # Step 4b: Log to Fitbit
-        fitbit_success = False
-        if workout_data["steps"] > 0 and workout_data["time"] > 0:
-            # Calculate workout start time (workout end time minus workout duration)
-            workout_end = datetime.now()
-            workout_duration_seconds = workout_data["time"]
-            workout_start_time = workout_end - timedelta(seconds=workout_duration_seconds)
-            start_time_str = workout_start_time.strftime("%H:%M")
-            duration_minutes = max(1, round(workout_duration_seconds / 60))  # At least 1 minute
-
-            step_start = time.time()
-            fitbit_success = log_to_fitbit(
-                workout_data["steps"],
-                duration_minutes,
-                start_time_str
-            )
-            fitbit_elapsed = time.time() - step_start
-            log_with_timestamp(f"    ⏱️  Fitbit: {fitbit_elapsed:.1f}s")
-            log_metric("fitbit", elapsed=round(fitbit_elapsed, 2), success=fitbit_success)
+        # Step 4: Save to database and Fitbit in worker threads - they don't need the pad,
+        # so BLE is released while they run instead of after
+        db_future = save_executor.submit(save_workout_to_db, workout_data)
+        fitbit_future = save_executor.submit(save_workout_to_fitbit, workout_data, datetime.now())
+        save_futures[:] = [db_future, fitbit_future]
 
         # Step 5: Disconnect cleanly (best effort)
         step_start = time.time()
@@ -343,6 +401,8 @@ async def stop_walking(address):
             log_with_timestamp(f"⚠️  Disconnect warning: {e}")
         log_with_timestamp(f"    ⏱️  Disconnect: {time.time() - step_start:.1f}s")
 
+        db_success, fitbit_success = await wait_for_saves()
+
         elapsed = time.time() - start_time
         log_with_timestamp(f"✅ Walk stopped successfully in {elapsed:.1f}s")
         log_metric("stop_walk", success=True, total_time=round(elapsed, 2))
@@ -378,10 +438,27 @@ async def main():
         log_with_timestamp(f"Fatal error: {e}")
         return {"success": False, "error": str(e)}
 
+async def wait_for_saves():
+    """Wait for the saves the last run started, even if that run was cancelled.
+
+    Returns (db_success, fitbit_success), or None if the run never got as far as saving.
+    """
+    if not save_futures:
+        return None
+    return tuple(await asyncio.gather(*(asyncio.wrap_future(f) for f in save_futures)))
+
+async def run():
+    """In-process entry point: run the stop sequence and return its result with the metrics emitted"""
+    metric_log.clear()
+    save_futures.clear()
+    result = await main()
+    result["metric_events"] = list(metric_log)
+    return result
+
 if __name__ == "__main__":
-    # Convert SIGTERM to KeyboardInterrupt so asyncio.run() triggers finally blocks
+    # Convert SIGTERM to KeyboardInterrupt so run_main() triggers finally blocks
     # (which disconnect BLE cleanly instead of orphaning the connection)
     signal.signal(signal.SIGTERM, signal.default_int_handler)
-    result = asyncio.run(main())
+    result = run_main(main())
     if not result["success"]:
         exit(1)
@@ -64,6 +64,7 @@ async def test_connection_manager():
     
     # Clean up
     await manager.disconnect_safe()
+    await manager.stop_scanner()
     print("\n✅ Test completed")
 
 if __name__ == "__main__":
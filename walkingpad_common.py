@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the stateless WalkingPad scripts (start_walk, stop_walk, set_speed)
+and the servers that drive them (simple_server, restserver)
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import orjson
+from bleak import BleakScanner
+from bleak import exc as bleak_exc
+from dotenv import load_dotenv
+
+# (second, formatted "%Y-%m-%d %H:%M:%S") so strftime only runs once per second
+_ts_cache = (0, "")
+
+def log_with_timestamp(message):
+    """Print message with timestamp"""
+    global _ts_cache
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    cached_sec, cached_str = _ts_cache
+    if sec != cached_sec:
+        cached_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+        _ts_cache = (sec, cached_str)
+    print(f"[{cached_str}.{ns // 1_000_000:03d}] {message}")
+
+
+def jresp(obj):
+    """Serialise obj with orjson into a Flask JSON response"""
+    from flask import Response  # servers only - keep Flask off the scripts' import path
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+
+# Metric entries emitted during the current run, handed back to in-process callers by the
+# scripts' run(). simple_server runs one script at a time, so a single list is enough.
+metric_log = []
+
+def log_metric(event_type, **data):
+    """Emit structured metrics for downstream analysis"""
+    entry = {
+        "event": event_type,
+        "ts": datetime.utcnow().isoformat() + "Z",
+    }
+    entry.update(data)
+    metric_log.append(entry)
+    print(f"[METRIC] {orjson.dumps(entry).decode()}")
+
+
+def run_main(coro):
+    """asyncio.run() for the scripts' __main__, on uvloop when it is installed"""
+    try:
+        import uvloop  # optional: faster scheduling of the pad's notification callbacks
+    except ImportError:
+        return asyncio.run(coro)
+    if sys.version_info >= (3, 11):
+        # A Runner keeps uvloop local to this run instead of replacing the global policy
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(coro)
+    uvloop.install()
+    return asyncio.run(coro)
+
+def reset_bleak_cache(gc_level=0):
+    """Force clear Bleak's internal BLE adapter state, collecting garbage up to generation gc_level"""
+    try:
+        log_with_timestamp("🔄 Resetting Bleak BLE cache after connection failure...")
+
+        # Clear Bleak's global scanner instances
+        import bleak
+        if hasattr(bleak, '_scanner_backends'):
+            bleak._scanner_backends.clear()
+
+        # The failed client's cycles are recent, so the youngest generation is usually enough;
+        # a full sweep of the heap stalls the loop and is left to callers on their last retry
+        import gc
+        gc.collect(gc_level)
+
+        log_with_timestamp("✅ Bleak cache reset complete")
+        return True
+    except Exception as e:
+        log_with_timestamp(f"⚠️  Bleak reset failed: {e}")
+        return False
+
+# Connection errors a retry can't fix: Bluetooth missing, off or denied, no BlueZ socket,
+# a malformed address. Timeouts, BleakError and device-not-found stay retryable.
+UNRECOVERABLE_ERRORS = (PermissionError, FileNotFoundError, ValueError)
+if hasattr(bleak_exc, "BleakBluetoothNotAvailableError"):  # bleak >= 1.0
+    UNRECOVERABLE_ERRORS += (bleak_exc.BleakBluetoothNotAvailableError,)
+
+def is_unrecoverable(error):
+    """True if retrying the connection can't help, so callers should fail fast"""
+    return isinstance(error, UNRECOVERABLE_ERRORS)
+
+def backoff_delay(attempt, base=0.5, cap=8.0, jitter=0.5):
+    """Exponential backoff for retry number attempt (0-based), capped, plus up to jitter*delay"""
+    return min(cap, base * (2 ** attempt)) * (1 + random.random() * jitter)
+
+@lru_cache(maxsize=1)
+def load_config():
+    """Load WalkingPad address from config, once per process"""
+    load_dotenv()
+
+    walkingpad_address = os.getenv('WALKINGPAD_ADDRESS')
+    if walkingpad_address:
+        return walkingpad_address
+
+    # Fallback to config.yaml; PyYAML is only imported when there is no env address
+    import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader  # LibYAML C parser when available
+    except ImportError:
+        from yaml import SafeLoader
+    with open("config.yaml", 'r') as stream:
+        config = yaml.load(stream, Loader=SafeLoader)
+        return config['address']
+
+# Discovered BLEDevice per address: {ADDRESS: (device, time.time(), loop)}. A BLEDevice is
+# bound to the event loop whose scanner found it (CoreBluetooth keeps that loop's delegate
+# in its details), and simple_server runs each request on a fresh loop - so an entry only
+# counts on the loop that created it, i.e. within one run.
+_device_cache = {}
+DEVICE_CACHE_TTL = 120  # seconds
+
+def _current_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+def cache_device(device):
+    """Remember a discovered WalkingPad for the rest of this event loop's run"""
+    _device_cache[device.address.upper()] = (device, time.time(), _current_loop())
+
+def cached_device(address):
+    """Return the BLEDevice discovered recently on the running loop, or None"""
+    entry = _device_cache.get(address.upper())
+    if entry and time.time() - entry[1] < DEVICE_CACHE_TTL and entry[2] is _current_loop():
+        return entry[0]
+    return None
+
+def forget_device(address):
+    """Drop a cached device, e.g. after connecting to it failed"""
+    _device_cache.pop(address.upper(), None)
+
+async def discover_walkingpad(address, timeout=15):
+    """Discover the WalkingPad device"""
+    device = cached_device(address)
+    if device is not None:
+        log_with_timestamp(f"✅ Using cached WalkingPad: {device.name} ({device.address})")
+        return device
+
+    discover_start = time.time()
+    log_with_timestamp(f"🔍 Discovering WalkingPad {address}...")
+
+    # Stops on the pad's first advertisement instead of scanning out the whole timeout
+    device = await BleakScanner.find_device_by_address(address, timeout=timeout)
+    discover_elapsed = time.time() - discover_start
+    log_with_timestamp(f"⏱️  Discovery completed in {discover_elapsed:.1f}s")
+
+    if device is None:
+        raise Exception(f"WalkingPad {address} not found within {timeout}s")
+
+    log_with_timestamp(f"✅ Found WalkingPad: {device.name} ({device.address})")
+    cache_device(device)
+    return device
+
+async def ensure_advertising(address, timeout=3.0):
+    """Quickly confirm the WalkingPad is advertising"""
+    try:
+        device = await BleakScanner.find_device_by_address(address, timeout=timeout)
+        if device is not None:
+            cache_device(device)
+        return device is not None
+    except Exception as exc:
+        log_with_timestamp(f"⚠️  Advertising check failed: {exc}")
+        return False